@@ -0,0 +1,168 @@
+# vim: set fileencoding=utf-8
+"""
+asyncio version of OFXClient, which sends OFX requests and receives the
+responses with non-blocking I/O, so that one process can keep many requests
+in flight at once.
+
+Requires Python 3.6+; ofxtools.AsyncOFXClient is only importable there.
+"""
+
+# stdlib imports
+import asyncio
+import ssl
+from io import BytesIO
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from email.parser import BytesHeaderParser
+
+
+# local imports
+from ofxtools.Client import OFXClient
+from ofxtools.Parser import OFXTree
+
+
+class AsyncOFXClient(OFXClient):
+    """
+    OFXClient whose download methods are coroutines.
+
+    Requests are built exactly as for OFXClient (signon(),
+    statement_request(), profile_request() etc.), then posted over HTTP/1.1
+    with asyncio streams.
+    """
+    async def download(self, request, timeout=None):
+        """
+        Post request; return the response body in a BytesIO, like
+        OFXClient.download().  timeout (in seconds) applies to connecting
+        and to each read.
+        """
+        source = BytesIO()
+        async for chunk in self.stream(request, timeout=timeout):
+            source.write(chunk)
+        source.seek(0)
+        self.response = source
+        return source
+
+    async def download_and_parse(self, request, timeout=None, convert=False,
+                                 keep_raw=False):
+        """
+        Post request, and feed the response body to OFXTree chunk by chunk as
+        it arrives.  Return the OFXTree (or the OFXResponse if convert is
+        True), as OFXClient.download_and_parse() does; likewise keep_raw.
+        """
+        tree = OFXTree()
+        raw = BytesIO() if keep_raw else None
+        async for chunk in self.stream(request, timeout=timeout):
+            if raw is not None:
+                raw.write(chunk)
+            tree.feed(chunk)
+        tree.close()
+        if raw is not None:
+            raw.seek(0)
+            self.response = raw
+        if convert:
+            return tree.convert()
+        return tree
+
+    async def stream(self, request, timeout=None):
+        """
+        Post request; asynchronously yield chunks of the response body.
+        """
+        url = urlparse(self.url)
+        if url.scheme == 'https':
+            port = url.port or 443
+            context = ssl.create_default_context()
+        else:
+            port = url.port or 80
+            context = None
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(url.hostname, port, ssl=context), timeout)
+        try:
+            body = self.serialize(request)
+            headers = dict(self.http_headers,
+                           **{'Host': url.netloc,
+                              'Content-Length': str(len(body)),
+                              'Connection': 'close'})
+            path = url.path or '/'
+            if url.query:
+                path += '?' + url.query
+            lines = ['POST %s HTTP/1.1' % path]
+            lines.extend(['%s: %s' % item for item in headers.items()])
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('ascii'))
+            writer.write(body)
+
+            async def wait(coro):
+                return await asyncio.wait_for(coro, timeout)
+
+            await wait(writer.drain())
+            status, headers = await self._read_head(reader, wait)
+            if status[1] != 200:
+                raise HTTPError(self.url, status[1], status[2], headers, None)
+
+            if headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                chunks = self._read_chunked(reader, wait)
+            elif headers.get('Content-Length') is not None:
+                chunks = self._read_length(reader, wait,
+                                           int(headers['Content-Length']))
+            else:
+                chunks = self._read_eof(reader, wait)
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            writer.close()
+            if hasattr(writer, 'wait_closed'):
+                # Python 3.7+
+                try:
+                    await asyncio.wait_for(writer.wait_closed(), timeout)
+                except (OSError, asyncio.TimeoutError):
+                    pass
+
+    @staticmethod
+    async def _read_head(reader, read):
+        """ Return ((version, code, reason), headers) of an HTTP response """
+        line = await read(reader.readline())
+        # The reason phrase may be empty, e.g. 'HTTP/1.1 200\r\n'
+        parts = line.decode('latin-1').split(None, 2)
+        try:
+            version, code = parts[:2]
+            code = int(code)
+        except ValueError:
+            raise HTTPError(None, None, 'Bad HTTP status line %r' % line,
+                            None, None)
+        reason = parts[2] if len(parts) > 2 else ''
+        # Header lines, up to the blank line (there may be none)
+        head = []
+        while True:
+            line = await read(reader.readline())
+            if not line.strip():
+                break
+            head.append(line)
+        headers = BytesHeaderParser().parsebytes(b''.join(head))
+        return (version, code, reason.strip()), headers
+
+    async def _read_length(self, reader, read, length):
+        while length > 0:
+            chunk = await read(reader.read(min(length, self.chunksize)))
+            if not chunk:
+                raise asyncio.IncompleteReadError(chunk, length)
+            length -= len(chunk)
+            yield chunk
+
+    async def _read_eof(self, reader, read):
+        while True:
+            chunk = await read(reader.read(self.chunksize))
+            if not chunk:
+                return
+            yield chunk
+
+    async def _read_chunked(self, reader, read):
+        while True:
+            line = await read(reader.readline())
+            size = int(line.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # Skip any trailers
+                while (await read(reader.readline())).strip():
+                    pass
+                return
+            yield await read(reader.readexactly(size))
+            await read(reader.readexactly(2))
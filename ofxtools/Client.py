@@ -8,11 +8,15 @@ and receiving OFX responses in reply
 # stdlib imports
 import sys
 import datetime
+import select
+import socket
+import threading
+import time
 import uuid
 import xml.etree.ElementTree as ET
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 import contextlib
-from io import StringIO
+from io import BytesIO
 from os import path
 import re
 from getpass import getpass
@@ -23,14 +27,19 @@ if  PYTHON_VERSION == 3:
     from configparser import SafeConfigParser
     from urllib.request import Request, urlopen, HTTPError
     from urllib.parse import urlparse
+    from queue import Queue, Empty
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
 else:
     from ConfigParser import SafeConfigParser
     from urllib2 import Request, urlopen, HTTPError
     from urlparse import urlparse
+    from Queue import Queue, Empty
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
 
 
 # local imports
 from ofxtools.header import OFXHeader
+from ofxtools.Parser import OFXTree
 from ofxtools.types import Bool, OneOf, DateTime
 from ofxtools.utils import fixpath
 from ofxtools.models import ACCTTYPES
@@ -156,6 +165,168 @@ class InvAcct(BankAcct):
         return bal
 
 
+class ConnectionPool(object):
+    """
+    Persistent (HTTP/1.1 keep-alive) connections, pooled per server.
+
+    Keeps up to maxsize idle connections to each (scheme, host, port), and
+    discards connections left idle for longer than idle_timeout seconds,
+    or closed by the server.  May be shared by several OFXClients, and
+    across threads.
+
+    A request that can't be sent over a reused connection is retried once
+    on a fresh one.  Once sent, it's never retried, since POST isn't
+    idempotent.
+    """
+    def __init__(self, maxsize=4, idle_timeout=60):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        # Map of server to list of (connection, time last used)
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def post(self, url, body, headers, timeout=None):
+        """
+        POST body to url; return the response body (bytes).
+        Raises HTTPError unless the response status is 200 OK.
+        """
+        return b''.join(self.stream(url, body, headers, timeout=timeout))
+
+    def stream(self, url, body, headers, timeout=None, chunksize=65536):
+        """
+        Generator version of post() that yields the response body in chunks
+        as it's received.  The connection goes back into the pool once the
+        response has been read to the end (and is closed otherwise).
+        """
+        url = urlparse(url)
+        server = (url.scheme, url.netloc)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+
+        connection, response = self._send(server, path, body, headers,
+                                          timeout)
+        if response.status != 200:
+            data = response.read()
+            self._release(server, connection, response)
+            raise HTTPError(url.geturl(), response.status, response.reason,
+                            response.msg, BytesIO(data))
+
+        complete = False
+        try:
+            while True:
+                chunk = response.read(chunksize)
+                if not chunk:
+                    break
+                yield chunk
+            complete = True
+        finally:
+            if complete:
+                self._release(server, connection, response)
+            else:
+                connection.close()
+
+    def _send(self, server, path, body, headers, timeout):
+        """ Send the request; return the connection and its response """
+        connection = self._checkout(server, timeout)
+        reused = connection is not None
+        while True:
+            if connection is None:
+                connection = self._connect(server, timeout)
+            try:
+                connection.request('POST', path, body, headers)
+            except (HTTPException, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                # The server may well have closed an idle connection.  The
+                # request wasn't sent in full, so the server can't have acted
+                # on it; retry once on a fresh connection.
+                connection = None
+                reused = False
+                continue
+            # POST isn't idempotent: once the request has been sent, don't
+            # retry it in case of failure.
+            try:
+                return connection, connection.getresponse()
+            except (HTTPException, socket.error):
+                connection.close()
+                raise
+
+    def _release(self, server, connection, response):
+        """ Return a connection to the pool after reading its response """
+        if response.will_close:
+            connection.close()
+        else:
+            self._checkin(server, connection)
+
+    def close(self):
+        """ Close all idle connections """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection, last_used in connections:
+                connection.close()
+
+    def _connect(self, server, timeout):
+        scheme, netloc = server
+        factory = HTTPSConnection if scheme == 'https' else HTTPConnection
+        if timeout is None:
+            return factory(netloc)
+        return factory(netloc, timeout=timeout)
+
+    def _checkout(self, server, timeout=None):
+        """
+        Return an idle connection to server, with its socket timeout set to
+        timeout (None for the global default), or None.
+        """
+        expired = []
+        connection = None
+        now = time.time()
+        with self._lock:
+            connections = self._idle.get(server, [])
+            while connections:
+                candidate, last_used = connections.pop()
+                if (now - last_used > self.idle_timeout
+                        or self._is_dropped(candidate)):
+                    expired.append(candidate)
+                else:
+                    connection = candidate
+                    break
+        for candidate in expired:
+            candidate.close()
+        if connection is not None:
+            if timeout is None:
+                timeout = socket.getdefaulttimeout()
+            # Used if the connection reconnects, as well as by its socket
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+        return connection
+
+    @staticmethod
+    def _is_dropped(connection):
+        """
+        Return True if the server has closed an idle connection (or sent it
+        anything unsolicited), i.e. its socket is readable.
+        """
+        sock = connection.sock
+        if sock is None:
+            return False
+        try:
+            return bool(select.select([sock], [], [], 0)[0])
+        except (ValueError, select.error, socket.error):
+            return True
+
+    def _checkin(self, server, connection):
+        with self._lock:
+            connections = self._idle.setdefault(server, [])
+            if len(connections) < self.maxsize:
+                connections.append((connection, time.time()))
+                return
+        connection.close()
+
+
 class OFXClient:
     """ """
     # OFX header/signon defaults
@@ -167,10 +338,19 @@ class OFXClient:
     bankid = None
     brokerid = None
 
-    def __init__(self, url, org, fid, version=None, appid=None, appver=None):
+    # Optional ConnectionPool, to reuse HTTP connections between downloads
+    pool = None
+
+    # Size of chunks read from the response body
+    chunksize = 65536
+
+    def __init__(self, url, org, fid, version=None, appid=None, appver=None,
+                 pool=None):
         self.url = url
         self.org = org
         self.fid = fid
+        if pool is not None:
+            self.pool = pool
         # Defaults
         if version:
             self.version = int(version)
@@ -237,31 +417,84 @@ class OFXClient:
         msgsrq.append(self._wraptrn(profrq))
         return ofx
 
-    def download(self, request):
-        """ """
-        mimetype = 'application/x-ofx'
-        HTTPheaders = {'Content-type': mimetype, 'Accept': '*/*, %s' % mimetype}
+    mimetype = 'application/x-ofx'
+
+    @property
+    def http_headers(self):
+        """ HTTP headers for posting OFX requests """
+        return {'Content-type': self.mimetype,
+                'Accept': '*/*, %s' % self.mimetype}
+
+    def serialize(self, request):
+        """ Return request (an OFX Element) as bytes, with OFX header """
         # py3k: ElementTree.tostring() returns bytes not str
         request = self.ofxheader + ET.tostring(request).decode()
+        return request.encode()
+
+    def download(self, request, timeout=None):
+        """ Return the response to request; also kept in self.response """
+        self.response = self._download(request, timeout=timeout)
+        return self.response
+
+    def _download(self, request, timeout=None):
+        """ download() without keeping the response in self.response """
+        # Collect the response in a BytesIO, so that we can use tell() and
+        # seek().  py3k: leave the bytes undecoded; OFXTree.parse() decodes
+        # per the charset in the OFX header.
+        source = BytesIO()
+        for chunk in self.stream(request, timeout=timeout):
+            source.write(chunk)
+        # After writing, rewind to the beginning.
+        source.seek(0)
+        return source
+
+    def download_and_parse(self, request, timeout=None, convert=False,
+                           keep_raw=False):
+        """
+        Download the response to request, feeding it to an OFXTree chunk by
+        chunk as it's received, rather than buffering the whole response
+        before parsing it.  The OFX header is validated as soon as it's
+        been received.
+
+        Return the OFXTree; or, if convert is True, the OFXResponse.
+
+        The raw response is discarded unless keep_raw is True, in which case
+        it's kept in self.response as by download().
+        """
+        tree = OFXTree()
+        raw = BytesIO() if keep_raw else None
+        for chunk in self.stream(request, timeout=timeout):
+            if raw is not None:
+                raw.write(chunk)
+            tree.feed(chunk)
+        tree.close()
+        if raw is not None:
+            raw.seek(0)
+            self.response = raw
+        if convert:
+            return tree.convert()
+        return tree
+
+    def stream(self, request, timeout=None):
+        """ Post request; yield chunks of the response body (bytes) """
+        body = self.serialize(request)
+        if self.pool is not None:
+            for chunk in self.pool.stream(self.url, body, self.http_headers,
+                                          timeout=timeout,
+                                          chunksize=self.chunksize):
+                yield chunk
+            return
+
         # py3k: urllib.request wants bytes not str
-        request = Request(self.url, request.encode(), HTTPheaders)
-        try:
-            with contextlib.closing(urlopen(request)) as response:
-                # py3k: urlopen returns bytes not str
-                response_ = response.read().decode()
-                # urllib2.urlopen returns an addinfourl instance, which supports
-                # a limited subset of file methods.  Copy response to a StringIO
-                # so that we can use tell() and seek().
-                source = StringIO()
-                source.write(response_)
-                # After writing, rewind to the beginning.
-                source.seek(0)
-                self.response = source
-                return source
-        except HTTPError as err:
-            # FIXME
-            print(err.info())
-            raise
+        request = Request(self.url, body, self.http_headers)
+        # Socket timeout (in seconds); None means the global default
+        kwargs = {'timeout': timeout} if timeout is not None else {}
+        with contextlib.closing(urlopen(request, **kwargs)) as response:
+            while True:
+                chunk = response.read(self.chunksize)
+                if not chunk:
+                    break
+                yield chunk
 
     def _wraptrn(self, rq):
         """ """
@@ -274,6 +507,80 @@ class OFXClient:
         return trnrq
 
 
+DownloadResult = namedtuple('DownloadResult', ['client', 'request', 'response',
+                                               'error', 'elapsed'])
+
+
+def download_all(jobs, workers=8, per_host=2, timeout=None):
+    """
+    Download OFX responses concurrently.
+
+    jobs is a sequence of (OFXClient, request) pairs, as returned by
+    OFXClient.statement_request()/profile_request().  They're run on a pool
+    of worker threads, with at most per_host requests in flight to any one
+    server, and timeout (in seconds) applied to each request's socket.
+
+    Yields a DownloadResult for each job as it completes (not in the order
+    given), so that responses can be parsed while others are still being
+    downloaded.  Errors are returned in DownloadResult.error rather than
+    raised, so one failing FI doesn't hold up the rest.  Responses are only
+    returned in DownloadResult.response, not kept in OFXClient.response.
+    DownloadResult.elapsed is the time taken by the download itself,
+    excluding any wait for the per_host limit.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return
+
+    # Interleave jobs from different servers, so that workers waiting on a
+    # busy server don't hold up requests to idle ones.
+    hosts = OrderedDict()
+    for client, request in jobs:
+        host = urlparse(client.url).netloc
+        hosts.setdefault(host, []).append((client, request))
+    todo = Queue()
+    while hosts:
+        for host in list(hosts.keys()):
+            todo.put((host, hosts[host].pop(0)))
+            if not hosts[host]:
+                del hosts[host]
+
+    limits = {}
+    for host, job in list(todo.queue):
+        limits.setdefault(host, threading.Semaphore(per_host))
+
+    done = Queue()
+
+    def work():
+        # All jobs are queued before the workers start; quit when they're gone
+        while True:
+            try:
+                host, (client, request) = todo.get_nowait()
+            except Empty:
+                return
+            response = error = None
+            with limits[host]:
+                # Time the download only, not the wait for the host's limit
+                start = time.time()
+                try:
+                    # Jobs may share a client; don't race to set its
+                    # .response attribute
+                    response = client._download(request, timeout=timeout)
+                except Exception as err:
+                    error = err
+                elapsed = time.time() - start
+            done.put(DownloadResult(client, request, response, error,
+                                    elapsed))
+
+    for n in range(min(workers, len(jobs))):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+
+    for n in range(len(jobs)):
+        yield done.get()
+
+
 ### CLI COMMANDS
 def do_stmt(args):
     client = OFXClient(args.url, args.org, args.fid, version=args.version,
@@ -312,7 +619,9 @@ def do_stmt(args):
         print(client.ofxheader + ET.tostring(request).decode())
     else:
         response = client.download(request)
-        print(response.read())
+        # py3k: write raw bytes to stdout as received from the server
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        stdout.write(response.read())
 
 
 class OFXConfigParser(SafeConfigParser):
@@ -6,10 +6,14 @@ Regex-based parser for OFXv1/v2 based on subclasses of ElemenTree from stdlib.
 # stdlib imports
 import xml.etree.ElementTree as ET
 import re
+import os
+import mmap
+from collections import Counter
 
 
 # local imports
-from ofxtools.header import OFXHeader
+from ofxtools import instrument
+from ofxtools.header import OFXHeader, OFXHeaderError
 from ofxtools.Response import OFXResponse
 
 
@@ -33,8 +37,9 @@ class Element(ET.Element):
         leaves = {}
         for child in self:
             tag = child.tag
-            data = child.text or ''
-            data = data.strip()
+            data = child.text
+            if data:
+                data = data.strip()
             if data:
                 # it's a data-bearing leaf element.
                 assert tag not in leaves
@@ -45,10 +50,10 @@ class Element(ET.Element):
                 # it's an aggregate.
                 assert tag not in aggs
                 aggs.update(child._flatten())
-        # Double-check no key collisions as we flatten aggregates & leaves
-        for key in aggs.keys():
-            assert key not in leaves
-        leaves.update(aggs)
+        if aggs:
+            # Double-check no key collisions as we flatten aggregates & leaves
+            assert set(aggs).isdisjoint(leaves)
+            leaves.update(aggs)
 
         return leaves
 
@@ -62,18 +67,170 @@ class OFXTree(ET.ElementTree):
     """
     element_factory = Element
 
-    def parse(self, source):
+    # List aggregates whose members are yielded by iterparse()
+    stream_containers = ('BANKTRANLIST', 'INVTRANLIST', 'INVPOSLIST',
+                         'SECLIST')
+
+    # How much data feed() will buffer looking for the end of the OFX header
+    max_header_size = 4096
+
+    def parse(self, source, use_mmap=False):
+        """
+        Parse a filename or file object.
+
+        If use_mmap is True, the file is memory-mapped rather than read, and
+        tokenized in place; only tag names and element text are copied onto
+        the heap.  Use this for very large files.
+        """
+        if not use_mmap:
+            self._parse(self._read(source))
+            return
+
+        source = self._mmap(source)
+        try:
+            self._parse(source)
+        finally:
+            try:
+                source.close()
+            except BufferError:
+                # Python 3 refuses while any memoryview of the map is alive,
+                # e.g. one referenced by the traceback of a ParseError; it's
+                # unmapped when garbage collected instead.
+                pass
+
+    def _parse(self, source):
+        """ Parse bytes (or an mmap) holding a whole OFX file """
+        # Validate the OFX header, then strip it.
+        # (strip() revalidates the header, which is short, and avoids copying
+        # the body of a memory-mapped file)
+        with instrument.stage('header'):
+            header, end = OFXHeader.parse(source)
+            body = OFXHeader.strip(source)
+        self.header = header
+
+        # Then parse tag soup into tree of Elements.
+        parser = self._treebuilder(encoding=header.codec)
+        parser.feed(body)
+        self._root = parser.close()
+
+    def iterparse(self, source, containers=None, chunksize=65536):
+        """
+        Generator version of parse() that yields each transaction, position
+        and security (i.e. each member of *TRANLIST, INVPOSLIST and SECLIST)
+        as soon as its end tag has been parsed.
+
+        The source is read and fed to TreeBuilder in chunks of ``chunksize``
+        characters; the first chunk must contain the whole OFX header.
+
+        Once the consumer asks for the next item, the previously yielded
+        subtree is detached from the parse tree, so memory use doesn't grow
+        with the number of list members.  After the generator is exhausted,
+        the remainder of the tree (SONRS, balances, etc.) is available as
+        usual via getroot()/find().
+        """
         if not hasattr(source, 'read'):
-            source = open(source)
-        source = source.read()
+            source = open(source, 'rb')
+
+        # Validate and strip the OFX header from the first chunk
+        chunk = source.read(chunksize)
+        with instrument.stage('header'):
+            header, end = OFXHeader.parse(chunk)
+        self.header = header
+        chunk = chunk[end:]
+
+        parser = self._treebuilder(
+            containers=containers or self.stream_containers,
+            encoding=header.codec)
+        while chunk:
+            parser.feed(chunk)
+            for elem in self._yield_events(parser):
+                yield elem
+            chunk = source.read(chunksize)
+        self._root = parser.close()
+        for elem in self._yield_events(parser):
+            yield elem
+
+    def feed(self, data):
+        """
+        Incremental version of parse(): feed successive chunks of an OFX
+        document (str or bytes) as they become available, e.g. as they're
+        received over the network, then call close().
 
-        # Validate and strip the OFX header
-        source = OFXHeader.strip(source)
+        Data is buffered until the whole OFX header has been received and
+        validated; thereafter each chunk goes straight to TreeBuilder.
+        """
+        parser = getattr(self, '_feed_parser', None)
+        if parser is not None:
+            parser.feed(data)
+            return
+
+        buffered = getattr(self, '_feed_buffer', None)
+        if buffered:
+            data = buffered + data
+        marker = '<OFX>' if isinstance(data, str) else b'<OFX>'
+        if data.find(marker) < 0:
+            if len(data) > self.max_header_size:
+                raise OFXHeaderError("Can't recognize OFX Header")
+            self._feed_buffer = data
+            return
 
-        # Then parse tag soup into tree of Elements
-        parser = TreeBuilder(element_factory=self.element_factory)
-        parser.feed(source)
+        with instrument.stage('header'):
+            header, end = OFXHeader.parse(data)
+        self.header = header
+        self._feed_buffer = None
+        self._feed_parser = self._treebuilder(encoding=header.codec)
+        self._feed_parser.feed(data[end:])
+
+    def close(self):
+        """
+        Finish parsing the data passed to feed(); return the root Element.
+        """
+        parser = getattr(self, '_feed_parser', None)
+        if parser is None:
+            # Never got as far as the OFX body
+            buffered = getattr(self, '_feed_buffer', None)
+            OFXHeader.parse(buffered or '')
+            raise OFXHeaderError('No OFX body after header')
+        self._feed_parser = None
         self._root = parser.close()
+        return self._root
+
+    def _treebuilder(self, **kwargs):
+        """ Return a TreeBuilder, instrumented if instrumentation is on """
+        if instrument.sink is not None:
+            Builder = InstrumentedTreeBuilder
+        else:
+            Builder = TreeBuilder
+        return Builder(element_factory=self.element_factory, **kwargs)
+
+    @staticmethod
+    def _yield_events(parser):
+        for parent, elem in parser.read_events():
+            yield elem
+            parent.remove(elem)
+
+    @staticmethod
+    def _read(source):
+        if not hasattr(source, 'read'):
+            # Read raw bytes; TreeBuilder decodes element text using the
+            # codec declared by the OFX header.
+            source = open(source, 'rb')
+        return source.read()
+
+    @staticmethod
+    def _mmap(source):
+        # The map stays valid after the file is closed
+        if hasattr(source, 'fileno'):
+            return OFXTree._map_file(source)
+        with open(source, 'rb') as f:
+            return OFXTree._map_file(f)
+
+    @staticmethod
+    def _map_file(f):
+        # mmap refuses to map an empty file; fail as parsing it would
+        if os.fstat(f.fileno()).st_size == 0:
+            raise OFXHeaderError("Can't recognize OFX Header")
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
     def convert(self):
         if not hasattr(self, '_root'):
@@ -88,14 +245,38 @@ class TreeBuilder(ET.TreeBuilder):
 
     Overrides ElementTree.TreeBuilder.feed() with a regex-based parser that
     handles both OFXv1(SGML) and OFXv2(XML).
+
+    feed() may be called repeatedly with successive chunks of the document;
+    tags cut off at a chunk boundary are held over until the next call to
+    feed() or close().
+
+    Data may be fed as str, or as bytes (or another buffer such as mmap, or
+    memoryview under Python 3).  Bytes are tokenized without decoding; only tag names and
+    element text are decoded, the latter using the given encoding.
     """
     # The body of an OFX document consists of a series of tags.
     # Each start tag may be followed by text (if a data-bearing element)
     # and optionally an end tag (not mandatory for OFXv1 syntax).
-    regex = re.compile(r"""<(?P<TAG>[A-Z1-9./]+?)>
+    pattern = r"""<(?P<TAG>[A-Z1-9./]+?)>
                             (?P<TEXT>[^<]+)?
                             (</(?P=TAG)>)?
-                            """, re.VERBOSE)
+                            """
+    regex = re.compile(pattern, re.VERBOSE)
+    bytes_regex = re.compile(pattern.encode('ascii'), re.VERBOSE)
+
+    def __init__(self, element_factory=None, containers=None,
+                 encoding='utf-8'):
+        super(TreeBuilder, self).__init__(element_factory=element_factory)
+        # Codec for element text fed as bytes
+        self.encoding = encoding
+        # Aggregates whose closed children are reported by read_events()
+        self._containers = frozenset(containers or ())
+        # Open elements, so we know each closed element's parent
+        self._stack = []
+        # (parent, element) pairs not yet collected by read_events()
+        self._events = []
+        # Unparsed data held over from the end of the last chunk fed
+        self._buffer = ''
 
     def feed(self, data):
         """
@@ -105,49 +286,110 @@ class TreeBuilder(ET.TreeBuilder):
         For non-data-bearing "aggregate" branches, parse the tag to distinguish
             start/end tag, and push or pop the Element accordingly.
         """
-        for match in self.regex.finditer(data):
-            tag, text, closeTag = match.groups()
-            text = (text or '').strip() # None has no strip() method
-            if len(text):
-                # OFX "element" (i.e. data-bearing leaf)
-                if tag.startswith('/'):
-                    msg = "<%s> is a closing tag, but has trailing text: '%s'"\
-                            % (tag, text)
-                    raise ParseError(msg)
-                self.start(tag, {})
-                self.data(text)
-                # End tags are optional for OFXv1 data elements
-                # End them all, whether or not they're explicitly ended
+        if self._buffer:
+            data = self._buffer + data
+        if isinstance(data, str):
+            regex, slash = self.regex, '/'
+        else:
+            regex, slash = self.bytes_regex, b'/'
+
+        # Everything from the last start tag onward may be incomplete (e.g.
+        # '<STMTT' or '<NAME>JOE'), so hold it over until more data arrives.
+        # Tags before it can't be affected by later data, because neither
+        # element text nor end tags can span a start tag.
+        held = []
+        tail = 0
+        for match in regex.finditer(data):
+            if not match.group('TAG').startswith(slash):
+                for heldmatch in held:
+                    self._process(*heldmatch.groups())
+                held = [match]
+            elif held:
+                held.append(match)
+            else:
+                self._process(*match.groups())
+                tail = match.end()
+        if held:
+            tail = held[0].start()
+
+        tail = data[tail:]
+        if isinstance(tail, memoryview):
+            tail = tail.tobytes()
+        self._buffer = tail
+
+    def close(self):
+        """ Parse any data held over from feed(); return the root Element """
+        data = self._buffer
+        regex = self.regex if isinstance(data, str) else self.bytes_regex
+        for match in regex.finditer(data):
+            self._process(*match.groups())
+        self._buffer = data[:0]
+        return super(TreeBuilder, self).close()
+
+    def read_events(self):
+        """
+        Return (parent, element) pairs for each child of a container
+        aggregate that has been closed since the last call.
+        """
+        events = self._events
+        self._events = []
+        return events
+
+    def _process(self, tag, text, closeTag):
+        """ Handle a single tag matched by regex """
+        if not isinstance(tag, str):
+            # Matched in bytes; decode only what goes into the parse tree
+            tag = tag.decode('ascii')
+            if text:
+                text = text.strip().decode(self.encoding)
+            if closeTag:
+                closeTag = closeTag.decode('ascii')
+        text = (text or '').strip() # None has no strip() method
+        if len(text):
+            # OFX "element" (i.e. data-bearing leaf)
+            if tag.startswith('/'):
+                msg = "<%s> is a closing tag, but has trailing text: '%s'"\
+                        % (tag, text)
+                raise ParseError(msg)
+            self.start(tag, {})
+            self.data(text)
+            # End tags are optional for OFXv1 data elements
+            # End them all, whether or not they're explicitly ended
+            try:
+                self.end(tag)
+            except ParseError as err:
+                err.message += ' </%s>' % tag # FIXME
+                raise ParseError(err.message)
+        else:
+            # OFX "aggregate" (tagged branch w/ no data)
+            if tag.startswith('/'):
+                # aggregate end tag
                 try:
-                    self.end(tag)
+                    self.end(tag[1:])
                 except ParseError as err:
                     err.message += ' </%s>' % tag # FIXME
                     raise ParseError(err.message)
             else:
-                # OFX "aggregate" (tagged branch w/ no data)
-                if tag.startswith('/'):
-                    # aggregate end tag
-                    try:
-                        self.end(tag[1:])
-                    except ParseError as err:
-                        err.message += ' </%s>' % tag # FIXME
-                        raise ParseError(err.message)
-                else:
-                    # aggregate start tag
-                    self.start(tag, {})
-                    # empty aggregates are legal, so handle them
-                    if closeTag:
-                        # regex captures the entire closing tag
-                       assert closeTag.replace(tag, '') == '</>'
-                       try:
-                           self.end(tag)
-                       except ParseError as err:
-                           err.message += ' </%s>' % tag # FIXME
-                           raise ParseError(err.message)
+                # aggregate start tag
+                self.start(tag, {})
+                # empty aggregates are legal, so handle them
+                if closeTag:
+                    # regex captures the entire closing tag
+                   assert closeTag.replace(tag, '') == '</>'
+                   try:
+                       self.end(tag)
+                   except ParseError as err:
+                       err.message += ' </%s>' % tag # FIXME
+                       raise ParseError(err.message)
+
+    def start(self, tag, attrs):
+        elem = super(TreeBuilder, self).start(tag, attrs)
+        self._stack.append(elem)
+        return elem
 
     def end(self, tag):
         try:
-            super(TreeBuilder, self).end(tag)
+            elem = super(TreeBuilder, self).end(tag)
         except AssertionError as err:
             # HACK: ET.TreeBuilder.end() raises an AssertionError for internal
             # errors generated by ET.TreeBuilder._flush(), but also for ending
@@ -158,3 +400,49 @@ class TreeBuilder(ET.TreeBuilder):
                 raise ParseError(err.message)
             else:
                 raise
+        self._stack.pop()
+        if self._stack and len(elem):
+            parent = self._stack[-1]
+            if parent.tag in self._containers:
+                self._events.append((parent, elem))
+        return elem
+
+
+class InstrumentedTreeBuilder(TreeBuilder):
+    """
+    TreeBuilder that reports, when closed, the time spent scanning the data
+    with regex ('tokenize' stage) vs. building the tree from the tags found
+    ('build' stage), and the number of elements per tag.
+
+    OFXTree uses it in place of TreeBuilder while instrumentation is enabled
+    (see ofxtools.instrument), so TreeBuilder itself carries no overhead.
+    """
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedTreeBuilder, self).__init__(*args, **kwargs)
+        self._tags = Counter()
+        self._elapsed = 0.0
+        self._building = 0.0
+
+    def feed(self, data):
+        start = instrument.timer()
+        super(InstrumentedTreeBuilder, self).feed(data)
+        self._elapsed += instrument.timer() - start
+
+    def close(self):
+        start = instrument.timer()
+        root = super(InstrumentedTreeBuilder, self).close()
+        self._elapsed += instrument.timer() - start
+        instrument.emit('stage', 'tokenize', self._elapsed - self._building)
+        instrument.emit('stage', 'build', self._building)
+        for tag, count in self._tags.items():
+            instrument.emit('tag', tag, count)
+        return root
+
+    def _process(self, tag, text, closeTag):
+        start = instrument.timer()
+        super(InstrumentedTreeBuilder, self)._process(tag, text, closeTag)
+        self._building += instrument.timer() - start
+
+    def start(self, tag, attrs):
+        self._tags[tag] += 1
+        return super(InstrumentedTreeBuilder, self).start(tag, attrs)
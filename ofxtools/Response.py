@@ -5,6 +5,7 @@ transaction lists, etc.)
 """
 
 # local imports
+from ofxtools import instrument
 from ofxtools.models import Aggregate
 from ofxtools.types import String, DateTime
 
@@ -27,35 +28,46 @@ class OFXResponse(object):
         self.tree = tree
 
         # SONRS - server response to signon request
-        sonrs = self.tree.find('SIGNONMSGSRSV1/SONRS')
-        self.sonrs = Aggregate.from_etree(sonrs)
+        self.sonrs = None
 
         # TRNRS - transaction response, which is the main section
         # containing account statements
         self.statements = []
 
-        # N.B. This iteration method doesn't preserve the original
-        # ordering of the statements within the OFX response
-        for stmtClass in (BankStatement, CreditCardStatement, InvestmentStatement):
-            tagname = stmtClass._tagName
-            for trnrs in self.tree.findall('*/%sTRNRS' % tagname):
-                # *STMTTRNRS may have no *STMTRS (in case of error).
-                # Don't blow up; skip silently.
-                stmtrs = trnrs.find('%sRS' % tagname)
-                if stmtrs is not None:
-                    stmt = stmtClass(stmtrs)
-                    # Staple the TRNRS wrapper data onto the STMT
-                    stmt.copyTRNRS(trnrs)
-                    self.statements.append(stmt)
-
         # SECLIST - list of description of securities referenced by
         # INVSTMT (investment account statement)
         self.securities = []
-        seclist = self.tree.find('SECLISTMSGSRSV1/SECLIST')
-        if seclist is None:
-            return
-        for sec in seclist:
-            self.securities.append(Aggregate.from_etree(sec))
+
+        # Make a single pass over the message set aggregates, dispatching
+        # their children on tag.  This preserves the original ordering of
+        # the statements within the OFX response.
+        with instrument.stage('convert'):
+            for msgs in self.tree.getroot():
+                for child in msgs:
+                    tag = child.tag
+                    stmtClass = STATEMENT_CLASSES.get(tag)
+                    if stmtClass is not None:
+                        self._do_trnrs(stmtClass, child)
+                    elif tag == 'SONRS':
+                        self.sonrs = Aggregate.from_etree(child)
+                    elif tag == 'SECLIST':
+                        self.securities.extend(
+                            [Aggregate.from_etree(sec) for sec in child])
+
+        if self.sonrs is None:
+            raise ValueError('OFX response contains no <SONRS>')
+
+    def _do_trnrs(self, stmtClass, trnrs):
+        # *STMTTRNRS may have no *STMTRS (in case of error).
+        # Don't blow up; skip silently.
+        stmtrs_tag = '%sRS' % stmtClass._tagName
+        for stmtrs in trnrs:
+            if stmtrs.tag == stmtrs_tag:
+                stmt = stmtClass(stmtrs)
+                # Staple the TRNRS wrapper data onto the STMT
+                stmt.copyTRNRS(trnrs)
+                self.statements.append(stmt)
+                break
 
     def __repr__(self):
         s = "<%s fid='%s' org='%s' dtserver='%s' len(statements)=%d len(securities)=%d>"
@@ -70,25 +82,62 @@ class OFXResponse(object):
 ### STATEMENTS
 class Statement(object):
     """ Base class for Python representation of OFX *STMT aggregate """
+    # Methods handling the children of *STMTRS, keyed by tag.  Children
+    # not listed here (e.g. MKTGINFO) are unsupported, and ignored.
+    _handlers = {'CURDEF': '_do_curdef'}
+
+    # Attributes set by the handlers of mandatory children, keyed by tag
+    _required = {}
+
     def __init__(self, stmtrs):
         """ Initialize with *STMTRS Element """
-        self.currency = stmtrs.find('CURDEF').text
-        self.account = Aggregate.from_etree(stmtrs.find(self._acctTag))
-        self._init(stmtrs)
-
-    def _init(self, stmtrs):
+        self.currency = None
+        self.account = None
+        self._init()
+
+        # Dispatch each child of *STMTRS in a single pass
+        handlers = self._handlers
+        for child in stmtrs:
+            tag = child.tag
+            if tag == self._acctTag:
+                self.account = Aggregate.from_etree(child)
+            else:
+                handler = handlers.get(tag)
+                if handler is not None:
+                    getattr(self, handler)(child)
+
+        if self.currency is None or self.account is None:
+            raise ValueError('<%s> must contain <CURDEF> and <%s>'
+                             % (stmtrs.tag, self._acctTag))
+        missing = sorted([tag for tag, attr in self._required.items()
+                          if getattr(self, attr) is None])
+        if missing:
+            raise ValueError('<%s> must contain <%s>'
+                             % (stmtrs.tag, '>, <'.join(missing)))
+
+    def _init(self):
         # Define in subclass
         raise NotImplementedError
 
+    def _do_curdef(self, curdef):
+        self.currency = curdef.text
+
     def copyTRNRS(self, trnrs):
         """ Attach the data fields from the *TRNRS wrapper to the STMT """
-        self.uid = String(36).convert(trnrs.find('TRNUID').text)
-        self.status = Aggregate.from_etree(trnrs.find('STATUS'))
-        cltcookie = trnrs.find('CLTCOOKIE')
-        if cltcookie is not None:
-            self.cookie = String(36).convert(cltcookie.text)
-        else:
-            self.cookie = None
+        self.uid = None
+        self.status = None
+        self.cookie = None
+        for child in trnrs:
+            tag = child.tag
+            if tag == 'TRNUID':
+                self.uid = String(36).convert(child.text)
+            elif tag == 'STATUS':
+                self.status = Aggregate.from_etree(child)
+            elif tag == 'CLTCOOKIE':
+                self.cookie = String(36).convert(child.text)
+        if self.uid is None or self.status is None:
+            raise ValueError('<%s> must contain <TRNUID> and <STATUS>'
+                             % trnrs.tag)
 
     def __repr__(self):
         # Define in subclass
@@ -99,37 +148,30 @@ class BankStatement(Statement):
     """ Python representation of OFX STMT (bank statement) aggregate """
     _tagName = 'STMT'
     _acctTag = 'BANKACCTFROM'
+    _handlers = dict(Statement._handlers,
+                     BANKTRANLIST='_do_banktranlist',
+                     LEDGERBAL='_do_ledgerbal',
+                     AVAILBAL='_do_availbal',
+                     BALLIST='_do_ballist')
+    _required = {'LEDGERBAL': 'ledgerbal'}
 
-    def _init(self, stmtrs):
-        # BANKTRANLIST
-        tranlist = stmtrs.find('BANKTRANLIST')
-        if tranlist is not None:
-            self.transactions = BANKTRANLIST(tranlist)
-        else:
-            self.transactions = []
-
-        # LEDGERBAL - mandatory
-        self.ledgerbal = Aggregate.from_etree(stmtrs.find('LEDGERBAL'))
-
-        # AVAILBAL
-        availbal = stmtrs.find('AVAILBAL')
-        if availbal is not None:
-            self.availbal = Aggregate.from_etree(availbal)
-        else:
-            self.availbal = None
-
-        # BALLIST
-        ballist = stmtrs.find('BALLIST')
-        if ballist:
-            self.other_balances = [Aggregate.from_etree(bal) for bal in ballist]
-        else:
-            self.other_balances = []
+    def _init(self):
+        self.transactions = []
+        self.ledgerbal = None
+        self.availbal = None
+        self.other_balances = []
 
-        # Unsupported subaggregates
-        for tag in ('MKTGINFO', ):
-            child = stmtrs.find(tag)
-            if child:
-                stmtrs.remove
+    def _do_banktranlist(self, tranlist):
+        self.transactions = BANKTRANLIST(tranlist)
+
+    def _do_ledgerbal(self, ledgerbal):
+        self.ledgerbal = Aggregate.from_etree(ledgerbal)
+
+    def _do_availbal(self, availbal):
+        self.availbal = Aggregate.from_etree(availbal)
+
+    def _do_ballist(self, ballist):
+        self.other_balances = [Aggregate.from_etree(bal) for bal in ballist]
 
     def __repr__(self):
         s = "<%s account=%s currency=%s ledgerbal=%s availbal=%s len(other_balances)=%d len(transactions)=%d>"
@@ -159,46 +201,37 @@ class InvestmentStatement(Statement):
     """
     _tagName = 'INVSTMT'
     _acctTag = 'INVACCTFROM'
-
-    def _init(self, invstmtrs):
-        dtasof = invstmtrs.find('DTASOF').text
-        self.datetime = DateTime().convert(dtasof)
-
-        # INVTRANLIST
-        tranlist = invstmtrs.find('INVTRANLIST')
-        if tranlist is not None:
-            self.transactions = INVTRANLIST(tranlist)
-        else:
-            self.transactions = []
-
-        # INVPOSLIST
-        poslist = invstmtrs.find('INVPOSLIST')
-        if poslist is not None:
-            self.positions = [Aggregate.from_etree(pos) for pos in poslist]
-        else:
-            self.positions = []
-
-        # INVBAL
-        invbal = invstmtrs.find('INVBAL')
-        if invbal is not None:
-            # First strip off BALLIST & process it
-            ballist = invbal.find('BALLIST')
-            if ballist is not None:
-                invbal.remove(ballist)
-                self.other_balances = [Aggregate.from_etree(bal) for bal in ballist]
-            else:
-                self.other_balances = []
-            # Now we can flatten the rest of INVBAL
-            self.balances = Aggregate.from_etree(invbal)
-        else:
-            self.balances = []
-            self.other_balances = []
-
-        # Unsupported subaggregates
-        for tag in ('INVOOLIST', 'INV401K', 'INV401KBAL', 'MKTGINFO'):
-            child = invstmtrs.find(tag)
-            if child is not None:
-                invstmtrs.remove
+    _handlers = dict(Statement._handlers,
+                     DTASOF='_do_dtasof',
+                     INVTRANLIST='_do_invtranlist',
+                     INVPOSLIST='_do_invposlist',
+                     INVBAL='_do_invbal')
+    _required = {'DTASOF': 'datetime'}
+
+    def _init(self):
+        self.datetime = None
+        self.transactions = []
+        self.positions = []
+        self.balances = []
+        self.other_balances = []
+
+    def _do_dtasof(self, dtasof):
+        self.datetime = DateTime().convert(dtasof.text)
+
+    def _do_invtranlist(self, tranlist):
+        self.transactions = INVTRANLIST(tranlist)
+
+    def _do_invposlist(self, poslist):
+        self.positions = [Aggregate.from_etree(pos) for pos in poslist]
+
+    def _do_invbal(self, invbal):
+        # First strip off BALLIST & process it
+        ballist = invbal.find('BALLIST')
+        if ballist is not None:
+            invbal.remove(ballist)
+            self.other_balances = [Aggregate.from_etree(bal) for bal in ballist]
+        # Now we can flatten the rest of INVBAL
+        self.balances = Aggregate.from_etree(invbal)
 
     def __repr__(self):
         s = "<%s datetime='%s' account=%s currency='%s' balances=%s len(other_balances)=%d len(positions)=%d len(transactions)=%d>"
@@ -213,6 +246,12 @@ class InvestmentStatement(Statement):
                    )
 
 
+# Statement classes keyed by the tag of their *TRNRS wrapper
+STATEMENT_CLASSES = dict([('%sTRNRS' % stmtClass._tagName, stmtClass)
+                          for stmtClass in (BankStatement, CreditCardStatement,
+                                            InvestmentStatement)])
+
+
 ### TRANSACTION LISTS
 class TransactionList(list):
     """
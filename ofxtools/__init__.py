@@ -2,3 +2,8 @@
 
 from ofxtools.Client import OFXClient
 from ofxtools.Parser import OFXTree
+
+import sys
+if sys.version_info >= (3, 6):
+    # Uses async generators
+    from ofxtools.AsyncClient import AsyncOFXClient
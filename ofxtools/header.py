@@ -2,6 +2,16 @@
 
 # stdlib imports
 import re
+import codecs
+import mmap
+
+
+try:
+    # Python 2 regexes search buffer objects, but not memoryview
+    _view = buffer
+except NameError:
+    def _view(source, offset):
+        return memoryview(source)[offset:]
 
 
 class OFXHeaderError(SyntaxError):
@@ -12,7 +22,7 @@ class OFXHeaderError(SyntaxError):
 class OFXHeader(object):
     """ """
     class v1(object):
-        regex = re.compile(r"""\s*
+        pattern = r"""\s*
                                 OFXHEADER:(?P<OFXHEADER>\d+)\s+
                                 DATA:(?P<DATA>[A-Z]+)\s+
                                 VERSION:(?P<VERSION>\d+)\s+
@@ -22,7 +32,9 @@ class OFXHeader(object):
                                 COMPRESSION:(?P<COMPRESjION>[A-Z]+)\s+
                                 OLDFILEUID:(?P<OLDFILEUID>[\w-]+)\s+
                                 NEWFILEUID:(?P<NEWFILEUID>[\w-]+)\s+
-                                """, re.VERBOSE)
+                                """
+        regex = re.compile(pattern, re.VERBOSE)
+        bytes_regex = re.compile(pattern.encode('ascii'), re.VERBOSE)
 
         tests = { 'OFXHEADER': ('100',),
                  'DATA': ('OFXSGML',),
@@ -32,7 +44,7 @@ class OFXHeader(object):
                 }
 
     class v2(object):
-        regex = re.compile(r"""(<\?xml\s+
+        pattern = r"""(<\?xml\s+
                                 (version=\"(?P<XMLVERSION>[\d.]+)\")?\s*
                                 (encoding=\"(?P<ENCODING>[\w-]+)\")?\s*
                                 (standalone=\"(?P<STANDALONE>[\w]+)\")?\s*
@@ -43,7 +55,9 @@ class OFXHeader(object):
                                 SECURITY=\"(?P<SECURITY>[A-Z]+)\"\s+
                                 OLDFILEUID=\"(?P<OLDFILEUID>[\w-]+)\"\s+
                                 NEWFILEUID=\"(?P<NEWFILEUID>[\w-]+)\"\s*
-                                \?>\s+""", re.VERBOSE)
+                                \?>\s+"""
+        regex = re.compile(pattern, re.VERBOSE)
+        bytes_regex = re.compile(pattern.encode('ascii'), re.VERBOSE)
 
         tests = { 'OFXHEADER': ('200',),
                  'VERSION': ('200', '203', '211'),
@@ -55,9 +69,31 @@ class OFXHeader(object):
         """ Return 1 for OFXv1; 2 for OFXv2 """
         return int(self.version)//100
 
-    def __init__(self, version, newfileuid):
+    @property
+    def codec(self):
+        """
+        Return the name of the Python codec for decoding the OFX body, as
+        declared by the ENCODING/CHARSET header fields (OFXv1) or the XML
+        declaration (OFXv2).
+        """
+        if self.major_version == 2:
+            return self.encoding or 'utf-8'
+        if self.encoding == 'UNICODE':
+            return 'utf-8'
+        # USASCII.  Most FIs send CHARSET:1252; the Windows codepages are all
+        # supersets of ASCII, so they won't choke on stray 8-bit characters.
+        codec = 'cp%s' % (self.charset or '1252')
+        try:
+            codecs.lookup(codec)
+        except LookupError:
+            codec = 'cp1252'
+        return codec
+
+    def __init__(self, version, newfileuid, encoding=None, charset=None):
         self.version = version
         self.newfileuid = newfileuid
+        self.encoding = encoding
+        self.charset = charset
 
     def __str__(self):
         if self.major_version == 1:
@@ -92,12 +128,24 @@ class OFXHeader(object):
             raise ValueError('Bad OFX version# %s' % self.version)
 
     @classmethod
-    def strip(cls, source):
+    def parse(cls, source):
+        """
+        Validate the OFX header at the beginning of source, which may be
+        str, bytes or any other buffer that the re module can search (e.g.
+        mmap, or memoryview under Python 3).
+
+        Return an OFXHeader instance and the offset where the OFX body begins.
+        """
         # First validate OFX header
         for headerspec in (cls.v1, cls.v2):
-            headermatch = headerspec.regex.match(source)
+            if isinstance(source, str):
+                regex = headerspec.regex
+            else:
+                regex = headerspec.bytes_regex
+            headermatch = regex.match(source)
             if headermatch is not None:
-                header = headermatch.groupdict()
+                header = dict((field, _text(value)) for field, value
+                              in headermatch.groupdict().items())
                 try:
                     for (field, valid) in headerspec.tests.items():
                         assert header[field] in valid
@@ -108,5 +156,24 @@ class OFXHeader(object):
         if headermatch is None:
             raise OFXHeaderError("Can't recognize OFX Header")
 
+        instance = cls(version=int(header['VERSION']),
+                       newfileuid=header['NEWFILEUID'],
+                       encoding=header['ENCODING'],
+                       charset=header.get('CHARSET'))
+        return instance, headermatch.end()
+
+    @classmethod
+    def strip(cls, source):
+        header, end = cls.parse(source)
         # Strip OFX header and return body
-        return source[headermatch.end():]
+        if isinstance(source, mmap.mmap):
+            # Slicing an mmap copies it onto the heap; return a view instead
+            return _view(source, end)
+        return source[end:]
+
+
+def _text(value):
+    """ Header fields matched in bytes come back as bytes; make them str """
+    if value is None or isinstance(value, str):
+        return value
+    return value.decode('ascii')
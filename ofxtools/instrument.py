@@ -0,0 +1,186 @@
+# vim: set fileencoding=utf-8
+"""
+Optional instrumentation of parsing, conversion and database loading.
+
+While enabled, instrumented code reports events to a sink, which is any
+callable taking (kind, name, value):
+
+    ('stage', name, seconds)       Time spent in a processing stage:
+                                   'header' (validating/stripping the OFX
+                                   header), 'tokenize' & 'build' (TreeBuilder
+                                   regex scanning vs. building the tree),
+                                   'convert' (OFXResponse), 'instantiate'
+                                   (ofxalchemy)
+    ('tag', name, count)           Number of elements parsed with a given tag
+    ('convert', name, seconds)     One call to the convert() method of the
+                                   ofxtools.types.Element subclass name
+    ('sql', verb, seconds)         One SQL statement executed (ofxalchemy),
+                                   keyed by its first word, e.g. 'SELECT'
+
+Collector is a sink that accumulates these in memory:
+
+    >>> with instrument.collecting() as stats:
+    ...     tree.parse(source)
+    ...     response = tree.convert()
+    >>> print(stats.report())
+
+While disabled (the default), instrumented code costs a single check of
+the module-level sink per stage or per Aggregate.
+"""
+
+# stdlib imports
+import contextlib
+import timeit
+from collections import Counter, defaultdict
+
+
+timer = timeit.default_timer
+
+# The active sink, or None when instrumentation is disabled
+sink = None
+
+# (install, uninstall) pairs registered by optional subsystems
+_hooks = []
+
+
+def enable(new_sink=None):
+    """
+    Start reporting events to new_sink (by default, a new Collector);
+    return the sink.
+    """
+    global sink
+    if new_sink is None:
+        new_sink = Collector()
+    if sink is None:
+        for install, uninstall in _hooks:
+            install()
+    sink = new_sink
+    return sink
+
+
+def disable():
+    """ Stop reporting events """
+    global sink
+    if sink is not None:
+        for install, uninstall in _hooks:
+            uninstall()
+    sink = None
+
+
+def enabled():
+    return sink is not None
+
+
+def emit(kind, name, value):
+    """ Report an event to the sink, if any """
+    if sink is not None:
+        sink(kind, name, value)
+
+
+def register(install, uninstall):
+    """
+    Register functions to be called when instrumentation is enabled &
+    disabled, e.g. to add & remove event listeners.
+    """
+    _hooks.append((install, uninstall))
+    if sink is not None:
+        install()
+
+
+@contextlib.contextmanager
+def collecting():
+    """ Enable instrumentation with a Collector for the duration """
+    collector = enable()
+    try:
+        yield collector
+    finally:
+        disable()
+
+
+class _Stage(object):
+    """ Context manager reporting its elapsed time as a stage """
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        emit('stage', self.name, timer() - self.start)
+
+
+class _NullStage(object):
+    """ Context manager that does nothing """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_null_stage = _NullStage()
+
+
+def stage(name):
+    """ Return a context manager timing a stage, if enabled """
+    if sink is None:
+        return _null_stage
+    return _Stage(name)
+
+
+class Collector(object):
+    """
+    Sink accumulating events in memory.
+
+    counts[kind][name] is the number of events (for 'tag' events, the number
+    of elements); times[kind][name] is the total seconds reported.
+    """
+    def __init__(self):
+        self.counts = defaultdict(Counter)
+        self.times = defaultdict(lambda: defaultdict(float))
+
+    def __call__(self, kind, name, value):
+        if kind == 'tag':
+            self.counts[kind][name] += value
+        else:
+            self.counts[kind][name] += 1
+            self.times[kind][name] += value
+
+    @property
+    def stages(self):
+        return dict(self.times['stage'])
+
+    @property
+    def tags(self):
+        return dict(self.counts['tag'])
+
+    @property
+    def queries(self):
+        """ Total number of SQL statements executed """
+        return sum(self.counts['sql'].values())
+
+    def clear(self):
+        self.counts.clear()
+        self.times.clear()
+
+    def report(self):
+        """ Return a summary of the collected events as text """
+        lines = []
+        for kind in ('stage', 'convert', 'sql'):
+            if not self.counts[kind]:
+                continue
+            lines.append('%s:' % kind)
+            for name, seconds in sorted(self.times[kind].items(),
+                                        key=lambda item: -item[1]):
+                lines.append('    %-20s %8d calls %10.4fs'
+                             % (name, self.counts[kind][name], seconds))
+        if self.counts['tag']:
+            lines.append('tag:')
+            for name, count in self.counts['tag'].most_common():
+                lines.append('    %-20s %8d' % (name, count))
+        return '\n'.join(lines)
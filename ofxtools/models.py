@@ -4,7 +4,12 @@ Python object model for fundamental data aggregates such as transactions,
 balances, and securities.
 """
 
+# stdlib imports
+import decimal
+
+
 # local imports
+from ofxtools import instrument
 from ofxtools.types import (Element, Bool, String, OneOf, Integer, Decimal,
                             DateTime)
 from ofxtools.lib import LANG_CODES, CURRENCY_CODES, COUNTRY_CODES
@@ -22,7 +27,137 @@ ASSETCLASSES = ('DOMESTICBOND', 'INTLBOND', 'LARGESTOCK', 'SMALLSTOCK',
                 'INTLSTOCK', 'MONEYMRKT', 'OTHER')
 
 
-class Aggregate(object):
+class AggregateMeta(type):
+    """
+    Metaclass that collects the Element descriptors of each Aggregate
+    subclass once, when the class is defined, so that instantiation doesn't
+    have to walk the MRO.
+
+    It also gives Aggregate instances __slots__ to hold their Element values.
+    Aggregate classes are combined by multiple inheritance (e.g.
+    SONRS(FI, STATUS)), which rules out nonempty __slots__ on the classes
+    themselves.  Instead every class gets empty __slots__, plus a hidden
+    subclass of the same name with a slot for each of its Elements, which
+    Aggregate.__new__() instantiates in its place.  Reading an Element value
+    is then a plain slot access; Aggregate.__setattr__() validates writes.
+    """
+    def __new__(mcs, name, bases, attrs):
+        attrs.setdefault('__slots__', ())
+        return super(AggregateMeta, mcs).__new__(mcs, name, bases, attrs)
+
+    def __init__(cls, name, bases, attrs):
+        super(AggregateMeta, cls).__init__(name, bases, attrs)
+        if attrs.get('_slotted'):
+            # cls is the hidden storage subclass; nothing more to do
+            return
+
+        elements = {}
+        # Walk the MRO from the root down, so that subclasses' definitions
+        # override those of their bases (as with normal attribute lookup)
+        for base in reversed(cls.__mro__):
+            elements.update([(k, v) for k, v in base.__dict__.items()
+                             if isinstance(v, Element)])
+        cls.elements = elements
+        cls._required = frozenset([k for k, v in elements.items()
+                                   if v.required])
+
+        # A __dict__ slot still allows setting extra attributes (e.g.
+        # MFINFO.mfassetclass); the dict is only allocated if that happens.
+        storage = AggregateMeta(name, (cls, ), {
+            '__slots__': tuple(elements) + ('__dict__', '__weakref__'),
+            '__module__': cls.__module__,
+            '_slotted': True,
+        })
+        storage._converters = tuple([
+            (k, v.convert, storage.__dict__[k].__set__)
+            for k, v in elements.items()])
+        storage._convert = _compile_converter(storage)
+        cls._storage = storage
+
+
+def _compile_converter(storage):
+    """
+    Generate the function converting flattened attributes for an Aggregate
+    storage class: one straight-line block per Element, which pops its value,
+    converts it inline and sets the slot.  This avoids a loop, and a call to
+    Element.convert() with its repeated None/required checks per value.
+
+    Values that the inlined fast path can't handle (e.g. invalid values,
+    Euro-style decimals) fall back to Element.convert(), so conversion
+    (including error reporting) is identical to the generic loop.
+    """
+    namespace = {'Decimal': decimal.Decimal,
+                 'InvalidOperation': decimal.InvalidOperation}
+    lines = ['def _convert(self, attributes):',
+             '    pop = attributes.pop']
+    for n, (name, convert, setslot) in enumerate(storage._converters):
+        element = convert.__self__
+        namespace['convert%d' % n] = convert
+        namespace['set%d' % n] = setslot
+        lines.append('    v = pop(%r, None)' % name)
+        if element.required:
+            # Let convert() raise the error
+            lines.extend(['    if v is None:',
+                          '        v = convert%d(v)' % n,
+                          '    else:'])
+        else:
+            lines.append('    if v is not None:')
+        inline = _INLINE_CONVERTERS.get(type(element), _inline_call)
+        lines.extend(['        ' + line
+                      for line in inline(element, n, namespace)])
+        lines.append('    set%d(self, v)' % n)
+
+    source = '\n'.join(lines) + '\n'
+    code = compile(source, '<%s converter>' % storage.__name__, 'exec')
+    exec(code, namespace)
+    return namespace['_convert']
+
+
+# Inline conversion of a value v that isn't None, keyed by Element type.
+# Each function returns source lines, and adds any names they use to the
+# namespace of the generated function.
+def _inline_call(element, n, namespace):
+    return ['v = convert%d(v)' % n]
+
+
+def _inline_string(element, n, namespace):
+    if element.length is None:
+        return ['v = str(v) if v else convert%d(v)' % n]
+    return ['v = str(v) if v and len(v) <= %d else convert%d(v)'
+            % (element.length, n)]
+
+
+def _inline_oneof(element, n, namespace):
+    namespace['valid%d' % n] = element.valid
+    return ['if v not in valid%d:' % n,
+            '    v = convert%d(v)' % n]
+
+
+def _inline_integer(element, n, namespace):
+    lines = ['v = int(v)']
+    if element.length is not None:
+        lines.extend(['if v >= %d:' % 10**element.length,
+                      '    v = convert%d(v)' % n])
+    return lines
+
+
+def _inline_decimal(element, n, namespace):
+    namespace['precision%d' % n] = element.precision
+    return ['try:',
+            '    v = Decimal(v).quantize(precision%d)' % n,
+            'except InvalidOperation:',
+            '    v = convert%d(v)' % n]
+
+
+_INLINE_CONVERTERS = {String: _inline_string, OneOf: _inline_oneof,
+                      Integer: _inline_integer, Decimal: _inline_decimal}
+
+
+# Python 2/3 compatible application of the metaclass
+_AggregateBase = AggregateMeta('_AggregateBase', (object,), {})
+
+
+class Aggregate(_AggregateBase):
     """
     Base class for Python representation of OFX 'aggregate', i.e. SGML parent
     node that contains no data.
@@ -39,24 +174,55 @@ class Aggregate(object):
     per the OFX specification, they are represented here by their own Python
     classes other than Aggregate.
     """
+    def __new__(cls, *args, **kwargs):
+        # Instantiate the subclass holding the slots (see AggregateMeta)
+        return object.__new__(cls._storage)
+
     def __init__(self, elem):
         assert elem.tag == self.__class__.__name__
         attributes = elem._flatten()
 
-        for name, element in self.elements.items():
-            value = attributes.pop(name, None)
-            setattr(self, name, value)
+        missing = self._required.difference(attributes)
+        if missing:
+            raise ValueError("Required element(s) missing for '%s': %s"
+                            % (self.__class__.__name__, sorted(missing)))
+
+        if instrument.sink is not None:
+            self._convert_instrumented(attributes)
+        else:
+            # Generated by AggregateMeta; see _compile_converter()
+            self._convert(attributes)
         if attributes:
             raise ValueError("Undefined element(s) for '%s': %s"
                             % (self.__class__.__name__, attributes.keys()))
 
-    @property
-    def elements(self):
-        d = {}
-        for m in self.__class__.__mro__:
-            d.update({k: v for k,v in m.__dict__.items() \
-                                    if isinstance(v, Element)})
-        return d
+    def _convert_instrumented(self, attributes):
+        """
+        Conversion loop of __init__(), reporting each converter call to
+        ofxtools.instrument.
+        """
+        timer = instrument.timer
+        for name, convert, setslot in self._converters:
+            start = timer()
+            value = convert(attributes.pop(name, None))
+            instrument.emit('convert', convert.__self__.__class__.__name__,
+                            timer() - start)
+            setslot(self, value)
+
+    def __setattr__(self, name, value):
+        """ Perform validation and type conversion of Element values """
+        element = self.elements.get(name)
+        if element is not None:
+            value = element.convert(value)
+        super(Aggregate, self).__setattr__(name, value)
+
+    def __reduce__(self):
+        # type(self) is the hidden storage subclass (see AggregateMeta), which
+        # pickle can't look up by name; rebuild through the public class.
+        state = dict([(name, getattr(self, name, None))
+                      for name in self.elements])
+        state.update(self.__dict__)
+        return (_restore_aggregate, (type(self).__bases__[0], state))
 
     @staticmethod
     def from_etree(elem):
@@ -69,7 +235,15 @@ class Aggregate(object):
         return instance
 
     def __repr__(self):
-        return '<%s %s>' % (self.__class__.__name__, ' '.join(['%s=%r' % (attr, str(getattr(self, attr))) for attr in self.elements.viewkeys() if getattr(self, attr) is not None]))
+        return '<%s %s>' % (self.__class__.__name__, ' '.join(['%s=%r' % (attr, str(getattr(self, attr))) for attr in self.elements if getattr(self, attr) is not None]))
+
+
+def _restore_aggregate(cls, state):
+    """ Unpickle an Aggregate; state holds already-converted values """
+    instance = cls.__new__(cls)
+    for name, value in state.items():
+        object.__setattr__(instance, name, value)
+    return instance
 
 
 class FI(Aggregate):
@@ -116,16 +290,25 @@ class ORIGCURRENCY(CURRENCY):
         """
         super(ORIGCURRENCY, self).__init__(elem)
 
-        currency = elem.find('*/CURRENCY')
-        origcurrency = elem.find('*/ORIGCURRENCY')
-        if (currency is not None) and (origcurrency is not None):
+        # Equivalent to elem.find('*/CURRENCY') & elem.find('*/ORIGCURRENCY'),
+        # without the overhead of ElementPath for every transaction
+        currency = origcurrency = False
+        for child in elem:
+            if len(child):
+                for grandchild in child:
+                    tag = grandchild.tag
+                    if tag == 'CURRENCY':
+                        currency = True
+                    elif tag == 'ORIGCURRENCY':
+                        origcurrency = True
+        if currency and origcurrency:
             raise ValueError("<%s> may not contain both <CURRENCY> and \
                              <ORIGCURRENCY>" % elem.tag)
-        curtype = currency
-        if curtype is None:
-            curtype = origcurrency
-        if curtype is not None:
-            curtype = curtype.tag
+        curtype = None
+        if currency:
+            curtype = 'CURRENCY'
+        elif origcurrency:
+            curtype = 'ORIGCURRENCY'
         self.curtype = curtype
 
 
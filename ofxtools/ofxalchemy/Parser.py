@@ -3,17 +3,28 @@
 Version of ofxtools.Parser that uses SQLAlchemy for conversion
 """
 # stdlib imports
+import datetime
+from collections import OrderedDict
 from decimal import Decimal
 
 # 3rd party imports
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import class_mapper
 from sqlalchemy.orm.exc import NoResultFound
 
 # local imports
 import ofxtools
+from ofxtools import instrument
 from ofxtools.ofxalchemy import models
 from ofxtools.ofxalchemy.models import DBSession
 
 
+# Upper bound on the number of parameters bound to a single lookup query
+# issued by instantiate_all(); SQLite allows at most 999 by default.
+MAX_BIND_PARAMS = 900
+
+
 class Element(ofxtools.Parser.Element):
     """ """
     attributes = {}
@@ -21,7 +32,7 @@ class Element(ofxtools.Parser.Element):
 
     def _dereference(self):
         """ """
-        reference = self.instantiate()
+        reference = self.instantiate_cached()
         self.clear()
         return reference
 
@@ -127,13 +138,10 @@ class Element(ofxtools.Parser.Element):
         if yld:
             self.attributes['yld'] = yld
 
-    def instantiate(self, **extra_attrs):
+    def flatten_attributes(self, **extra_attrs):
         """
-        Create an instance of a SQLAlchemy model class corresponding to
-        my OFX tag, with attributes given by my contained OFX elements.
-
-        If an instance that matches the given primary key signature has
-        already been given, return that instead of creating a new one.
+        Return the SQLAlchemy model class corresponding to my OFX tag,
+        together with the attributes given by my contained OFX elements.
         """
         self.extra_attributes = extra_attrs
         # SECID needs to instantiate as SECINFO
@@ -146,17 +154,173 @@ class Element(ofxtools.Parser.Element):
         self._postflatten()
         self.attributes.update(self.extra_attributes)
         self.extra_attributes = {}
+        return SubClass, self.attributes
+
+    def instantiate(self, **extra_attrs):
+        """
+        Create an instance of a SQLAlchemy model class corresponding to
+        my OFX tag, with attributes given by my contained OFX elements.
 
-        try:
-            fingerprint = SubClass._fingerprint(**self.attributes)
-            instance = DBSession.query(SubClass).filter_by(**fingerprint).one()
-        except NoResultFound:
-            instance = SubClass(**self.attributes)
-            DBSession.add(instance)
+        If an instance that matches the given primary key signature has
+        already been given, return that instead of creating a new one.
+        """
+        SubClass, attributes = self.flatten_attributes(**extra_attrs)
+        return _resolve(SubClass, attributes)
 
+    def instantiate_cached(self, **extra_attrs):
+        """
+        Like instantiate(), but first look for the instance in the session's
+        identity map (see identity_map()), and remember it there.  Used for
+        references (SECID, PAYEE, {BANK,CC}ACCTTO) that recur throughout
+        a statement, to resolve repeats without any SQL.
+        """
+        SubClass, attributes = self.flatten_attributes(**extra_attrs)
+        key = _identity_key(SubClass, attributes)
+        cache = identity_map()
+        instance = cache.get(key)
+        if instance is None or instance not in DBSession:
+            instance = _resolve(SubClass, attributes)
+            cache[key] = instance
         return instance
 
 
+def _resolve(SubClass, attributes):
+    """
+    Return the persisted instance of SubClass whose primary keys match
+    attributes; or else create one and add it to the session.
+    """
+    try:
+        fingerprint = SubClass._fingerprint(**attributes)
+        instance = DBSession.query(SubClass).filter_by(**fingerprint).one()
+    except NoResultFound:
+        instance = SubClass(**attributes)
+        DBSession.add(instance)
+
+    return instance
+
+
+def identity_map():
+    """
+    Return the map of instances dereferenced during an ingestion run, keyed
+    by (model base class, primary key tuple).  It's stored with the current
+    session, so it lasts until DBSession.remove(); entries for instances no
+    longer in the session (e.g. after close or rollback) are ignored.
+    """
+    return DBSession.info.setdefault('ofxalchemy.identity_map', {})
+
+
+def remember(instances):
+    """ Add instances (e.g. from SECLIST) to the session's identity map """
+    cache = identity_map()
+    for instance in instances:
+        SubClass = instance.__class__
+        pks = SubClass.primary_keys()
+        cache[_identity_key(SubClass, dict([
+            (pk, getattr(instance, pk)) for pk in pks]))] = instance
+
+
+def _identity_key(SubClass, attributes):
+    """
+    Key for identity_map().  Use the base model class, so that e.g. a SECID
+    (instantiated as SECINFO) finds the STOCKINFO given in SECLIST.
+    """
+    BaseClass = class_mapper(SubClass).base_mapper.class_
+    return BaseClass, _fingerprint_key(SubClass, attributes)
+
+
+def instantiate_all(elements, **extra_attrs):
+    """
+    Bulk version of Element.instantiate().
+
+    Flatten all the given Elements, then resolve the ones already persisted
+    with a single query (per model class) selecting all their fingerprints,
+    rather than a query per Element.  Only the missing instances are created
+    and added to the session.  Return the instances in the order given.
+    """
+    flattened = [elem.flatten_attributes(**extra_attrs) for elem in elements]
+
+    # Make sure that pending instances referenced by the fingerprints (e.g.
+    # a newly created *ACCTFROM) have been assigned their ids.
+    DBSession.flush()
+
+    # Group fingerprints by model class
+    keys = []
+    fingerprints = OrderedDict()
+    for SubClass, attributes in flattened:
+        key = _fingerprint_key(SubClass, attributes)
+        keys.append(key)
+        fingerprints.setdefault(SubClass, set()).add(key)
+
+    instances = {}
+    for SubClass, classkeys in fingerprints.items():
+        for instance in _query_fingerprints(SubClass, classkeys):
+            key = (SubClass, tuple([_normalize(SubClass, pk, getattr(instance, pk))
+                                    for pk in SubClass.primary_keys()]))
+            instances[key] = instance
+
+    result = []
+    with DBSession.no_autoflush:
+        for (SubClass, attributes), key in zip(flattened, keys):
+            instance = instances.get((SubClass, key))
+            if instance is None:
+                instance = SubClass(**attributes)
+                DBSession.add(instance)
+                # Later duplicates within the batch map to this instance
+                instances[(SubClass, key)] = instance
+            result.append(instance)
+    return result
+
+
+def _fingerprint_key(SubClass, attributes):
+    """
+    Return a hashable tuple of the primary key values given by attributes,
+    replacing relationships with their foreign key ids.
+    """
+    fingerprint = SubClass._fingerprint(**attributes)
+    values = []
+    for pk in SubClass.primary_keys():
+        if pk in fingerprint:
+            value = fingerprint[pk]
+        else:
+            # Relationship, not FK id integer (cf. Base._bindattr())
+            value = fingerprint[pk[:-3]].id
+        values.append(_normalize(SubClass, pk, value))
+    return tuple(values)
+
+
+def _normalize(SubClass, pk, value):
+    """
+    Convert a primary key value to the type that's returned by the database,
+    so that values from OFX can be compared with values from queries.
+    """
+    coltype = getattr(SubClass, pk).property.columns[0].type
+    process = getattr(coltype, 'process_bind_param', None)
+    if process is not None and value is not None:
+        value = process(value, None)
+    return value
+
+
+def _query_fingerprints(SubClass, keys, entities=None):
+    """
+    Yield the persisted instances of SubClass matching any of the given
+    primary key tuples (or, if given, the query entities of those rows).
+    """
+    pks = SubClass.primary_keys()
+    keys = [key for key in keys if None not in key]
+    chunksize = max(MAX_BIND_PARAMS // len(pks), 1)
+    for start in range(0, len(keys), chunksize):
+        chunk = keys[start:start+chunksize]
+        # Select the rows matching each primary key column separately;
+        # this is portable across DB backends, unlike tuple IN, at the cost
+        # of possibly returning a few extra rows, which are simply not used.
+        query = DBSession.query(*(entities or [SubClass]))
+        for n, pk in enumerate(pks):
+            column = getattr(SubClass, pk)
+            query = query.filter(column.in_(set([key[n] for key in chunk])))
+        for row in query:
+            yield row
+
+
 class OFXTree(ofxtools.Parser.OFXTree):
     """ """
     element_factory = Element
@@ -164,18 +328,37 @@ class OFXTree(ofxtools.Parser.OFXTree):
     def convert(self):
         raise NotImplementedError
 
-    def instantiate(self):
-        """ """
+    def instantiate(self, bulk=False, loader=None):
+        """
+        Create SQLAlchemy model instances from the parse tree, and add them
+        to the session.
+
+        If bulk is True, look up existing instances with a few queries per
+        list of securities/transactions/positions/balances (see
+        instantiate_all()) rather than a query per instance.
+
+        If a loader (ofxalchemy.bulk.BulkLoader) is given, transactions and
+        positions are queued on it as attribute dicts instead of being
+        instantiated; call loader.flush() to insert them.
+        """
         if not hasattr(self, '_root'):
             raise ValueError('Must first call parse() to have data to instantiate')
+        with instrument.stage('instantiate'):
+            self._instantiate(bulk, loader)
+
+    def _instantiate(self, bulk, loader):
         # SECLIST - list of description of securities referenced by
         # INVSTMT (investment account statement)
         seclist = self.find('SECLISTMSGSRSV1/SECLIST')
         if seclist is not None:
-            self.securities = [
-                sec.instantiate()
-                for sec in seclist
-            ]
+            if bulk:
+                self.securities = instantiate_all(seclist)
+                remember(self.securities)
+            else:
+                self.securities = [
+                    sec.instantiate_cached()
+                    for sec in seclist
+                ]
             DBSession.add_all(self.securities)
         else:
             self.securities = []
@@ -193,9 +376,63 @@ class OFXTree(ofxtools.Parser.OFXTree):
                 # Don't blow up; skip silently.
                 stmtrs = trnrs.find('%sRS' % tagname)
                 if stmtrs is not None:
-                    stmt = stmtClass(stmtrs)
+                    stmt = stmtClass(stmtrs, bulk=bulk, loader=loader)
                     self.statements.append(stmt)
 
+    def ingestion(self, digest):
+        """
+        Create an INGESTION ledger entry for the instantiated file, with the
+        given hash of its contents (see INGESTION.hash_file()), and merge it
+        into the session (replacing any previous entry for the same file).
+        """
+        if not hasattr(self, 'statements'):
+            raise ValueError('Must first call instantiate() to record ingestion')
+        newfileuid = self.header.newfileuid
+        if newfileuid == 'NONE':
+            newfileuid = None
+        fi = self.find('SIGNONMSGSRSV1/SONRS/FI')
+        org = fid = None
+        if fi is not None:
+            org = fi.findtext('ORG')
+            fid = fi.findtext('FID')
+        acctfrom = None
+        if self.statements:
+            acctfrom = self.statements[0].account
+        entry = models.INGESTION(
+            digest=digest, newfileuid=newfileuid, org=org, fid=fid,
+            acctfrom=acctfrom, dtingested=datetime.datetime.utcnow())
+        return DBSession.merge(entry)
+
+
+### INSTRUMENTATION
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('ofxtools.instrument', []).append(instrument.timer())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    starts = conn.info.get('ofxtools.instrument')
+    if starts:
+        # Otherwise, instrumentation was enabled during execution
+        elapsed = instrument.timer() - starts.pop()
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        instrument.emit('sql', verb, elapsed)
+
+
+def _listen_sql():
+    """ Report SQL statements executed by any engine to instrument """
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _unlisten_sql():
+    event.remove(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.remove(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+instrument.register(_listen_sql, _unlisten_sql)
+
 
 ### STATEMENTS
 class Statement(object):
@@ -203,8 +440,10 @@ class Statement(object):
     currency = None
     account = None
 
-    def __init__(self, stmtrs):
+    def __init__(self, stmtrs, bulk=False, loader=None):
         """ Initialize with *STMTRS Element """
+        self.bulk = bulk
+        self.loader = loader
         self.currency = stmtrs.find('CURDEF').text
         acctfrom = stmtrs.find(self._acctTag)
         self.account = acctfrom.instantiate()
@@ -217,6 +456,12 @@ class Statement(object):
         # Define in subclass
         raise NotImplementedError
 
+    def _instantiate_all(self, elements, **extra_attrs):
+        """ Instantiate a list of Elements, in bulk if so configured """
+        if self.bulk:
+            return instantiate_all(elements, **extra_attrs)
+        return [elem.instantiate(**extra_attrs) for elem in elements]
+
     def from_etree(elem):
         # Define in subclass
         raise NotImplementedError
@@ -235,8 +480,11 @@ class BankStatement(Statement):
         # BANKTRANLIST
         tranlist = stmtrs.find('BANKTRANLIST')
         if tranlist is not None:
-            self.transactions = TransactionList(self.account, tranlist)
-            DBSession.add_all(self.transactions)
+            self.transactions = TransactionList(self.account, tranlist,
+                                                bulk=self.bulk,
+                                                loader=self.loader)
+            if self.loader is None:
+                DBSession.add_all(self.transactions)
 
         # LEDGERBAL - mandatory
         ledgerbal = stmtrs.find('LEDGERBAL')
@@ -253,7 +501,7 @@ class BankStatement(Statement):
 
         ballist = stmtrs.find('BALLIST')
         if ballist:
-            self.other_balances = [bal.instantiate() for bal in ballist]
+            self.other_balances = self._instantiate_all(ballist)
             DBSession.add_all(self.other_balances)
 
         # Unsupported subaggregates
@@ -298,8 +546,11 @@ class InvestmentStatement(Statement):
         # INVTRANLIST
         tranlist = invstmtrs.find('INVTRANLIST')
         if tranlist is not None:
-            self.transactions = TransactionList(self.account, tranlist)
-            DBSession.add_all(self.transactions)
+            self.transactions = TransactionList(self.account, tranlist,
+                                                bulk=self.bulk,
+                                                loader=self.loader)
+            if self.loader is None:
+                DBSession.add_all(self.transactions)
 
         # INVPOSLIST
         poslist = invstmtrs.find('INVPOSLIST')
@@ -323,11 +574,19 @@ class InvestmentStatement(Statement):
                     positions[seckey] = (position[0],
                                          position[1] + Decimal(units.text)
                                         )
-            self.positions = [pos.instantiate(
-                units=units, acctfrom=self.account,
-                dtasof=self.datetime) \
-                for pos, units in positions.values()]
-            DBSession.add_all(self.positions)
+            if self.loader is not None:
+                self.positions = [self.loader.add(*pos.flatten_attributes(
+                    units=units, acctfrom=self.account,
+                    dtasof=self.datetime)) \
+                    for pos, units in positions.values()]
+            else:
+                # Each INVPOS lot has its own units, so it can't share
+                # extra attributes with the others via instantiate_all()
+                self.positions = [pos.instantiate(
+                    units=units, acctfrom=self.account,
+                    dtasof=self.datetime) \
+                    for pos, units in positions.values()]
+                DBSession.add_all(self.positions)
         else:
             self.positions = []
 
@@ -338,10 +597,9 @@ class InvestmentStatement(Statement):
             ballist = invbal.find('BALLIST')
             if ballist is not None:
                 invbal.remove(ballist)
-                self.other_balances = [
-                    bal.instantiate(acctfrom=self.account, dtasof=self.datetime,
-                                   ) for bal in ballist
-                ]
+                self.other_balances = self._instantiate_all(
+                    ballist, acctfrom=self.account, dtasof=self.datetime,
+                )
                 DBSession.add_all(self.other_balances)
             # Now we can flatten the rest of INVBAL
             self.balances = invbal.instantiate(
@@ -379,13 +637,20 @@ class TransactionList(list):
     Base class for Python representation of OFX *TRANLIST (transaction list)
     aggregate
     """
-    def __init__(self, account, tranlist):
+    def __init__(self, account, tranlist, bulk=False, loader=None):
         self.account = account
         dtstart, dtend = tranlist[0:2]
         tranlist = tranlist[2:]
         self.dtstart = ofxtools.types.DateTime().convert(dtstart.text)
         self.dtend = ofxtools.types.DateTime().convert(dtend.text)
-        self.extend([self.etree_to_sql(tran) for tran in tranlist])
+        if loader is not None:
+            # Queue attribute dicts to be inserted by the loader
+            self.extend([loader.add(*tran.flatten_attributes(
+                acctfrom=self.account)) for tran in tranlist])
+        elif bulk:
+            self.extend(instantiate_all(tranlist, acctfrom=self.account))
+        else:
+            self.extend([self.etree_to_sql(tran) for tran in tranlist])
 
     def etree_to_sql(self, tran):
         """ Convert transaction (OFX *TRAN) """
@@ -6,3 +6,5 @@ from models import (
 import Parser
 from Parser import OFXTree as OFXParser
 import types
+import bulk
+from bulk import BulkLoader
@@ -0,0 +1,264 @@
+# vim: set fileencoding=utf-8
+"""
+Bulk loader for ofxalchemy, inserting flattened OFX aggregates with SQLAlchemy
+Core executemany() rather than through the ORM unit of work.
+"""
+# stdlib imports
+import time
+from collections import OrderedDict
+
+# 3rd party imports
+from sqlalchemy import Integer, bindparam, text
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.schema import UniqueConstraint
+
+# local imports
+from ofxtools.ofxalchemy.models import Base, DBSession
+from ofxtools.ofxalchemy.Parser import (
+    _fingerprint_key,
+    _normalize,
+    _query_fingerprints,
+)
+
+
+class BulkLoader(object):
+    """
+    Collect (model class, attributes) pairs as returned by
+    Element.flatten_attributes(), and insert them with one executemany() per
+    table.  Joined-table inheritance (e.g. INVTRAN and its subclasses) is
+    handled by inserting the parent table rows first, then reading back their
+    surrogate ids by natural key to insert the child table rows.
+
+    Records whose primary keys are already in the database (or earlier in
+    the same batch) are skipped, as Element.instantiate() would.
+
+    Relationships to other model instances (e.g. acctfrom, secinfo) are
+    converted to their foreign keys; the session is flushed first so those
+    instances have been assigned ids.  For joined-table inheritance, the
+    natural keys must live in the parent table (as for INVTRAN & INVPOS).
+
+    If on_conflict is 'nothing' or 'update', records are instead upserted
+    with INSERT ... ON CONFLICT (on SQLite >= 3.24 or PostgreSQL), keyed on
+    the natural keys given by the models' pks/UniqueConstraints.  This
+    dispenses with looking up which records are already persisted; existing
+    rows are left alone or updated, respectively.  A joined-inheritance
+    record whose natural key is held by an existing parent row of a
+    different subclass (e.g. a SELLSTOCK reusing a BUYSTOCK's FITID) is
+    skipped, rather than hanging a child row off the wrong parent.
+    """
+    conflict_actions = (None, 'nothing', 'update')
+
+    def __init__(self, session=DBSession, on_conflict=None):
+        if on_conflict not in self.conflict_actions:
+            raise ValueError("on_conflict must be one of %s, not '%s'"
+                             % (self.conflict_actions, on_conflict))
+        self.session = session
+        self.on_conflict = on_conflict
+        self.pending = []
+        # Statistics, accumulated over all calls to flush()
+        self.records = 0
+        self.rows = 0
+        self.elapsed = 0.0
+
+    def add(self, SubClass, attributes):
+        """ Queue a record for insertion; return its attributes """
+        self.pending.append((SubClass, attributes))
+        return attributes
+
+    def flush(self):
+        """
+        Insert all queued records; return the number inserted (when
+        upserting, the number inserted or updated).
+
+        Counts are taken from the rowcount reported by the database driver,
+        where it's reliable; otherwise they're the number of rows submitted.
+        """
+        start = time.time()
+        self.session.flush()
+        pending, self.pending = self.pending, []
+
+        # Drop records that are already persisted, or duplicated in the batch
+        keys = OrderedDict()
+        for SubClass, attributes in pending:
+            key = _fingerprint_key(SubClass, attributes)
+            keys.setdefault(SubClass, OrderedDict()).setdefault(
+                key, attributes)
+        records = []
+        for SubClass, classkeys in keys.items():
+            if self.on_conflict is None:
+                existing = _existing_keys(SubClass, classkeys)
+            else:
+                existing = ()
+            records.extend([(SubClass, key, attributes)
+                            for key, attributes in classkeys.items()
+                            if key not in existing])
+
+        # Insert rows table by table, in dependency order
+        ids = {}
+        loaded = 0
+        for table in Base.metadata.sorted_tables:
+            batch = [(SubClass, key, attributes)
+                     for SubClass, key, attributes in records
+                     if table in class_mapper(SubClass).tables]
+            if not batch:
+                continue
+            columns = [c for c in table.c if not _is_surrogate(c)]
+            if 'id' in table.c and not _is_surrogate(table.c.id):
+                # Child table of joined inheritance; skip records whose parent
+                # row belongs to another subclass
+                batch = [rec for rec in batch if rec[:2] in ids]
+                if not batch:
+                    continue
+            rows = []
+            for SubClass, key, attributes in batch:
+                row = _row(SubClass, attributes)
+                if 'id' in table.c and not _is_surrogate(table.c.id):
+                    # Child table of joined inheritance
+                    row['id'] = ids[(SubClass, key)]
+                rows.append(dict([(c.key, row.get(c.key)) for c in columns]))
+            result = self.session.execute(self._insert(table, columns), rows)
+            count = self._rowcount(result, len(rows))
+            self.rows += count
+            if not ('id' in table.c and not _is_surrogate(table.c.id)):
+                # Each record has exactly one row outside child tables
+                loaded += count
+
+            if 'id' in table.c and _is_surrogate(table.c.id):
+                # Parent table of joined inheritance; read back the ids
+                for SubClass in set([rec[0] for rec in batch]):
+                    ids.update(_surrogate_ids(SubClass, [
+                        key for cls, key, attributes in batch
+                        if cls is SubClass]))
+
+        self.records += loaded
+        self.elapsed += time.time() - start
+        return loaded
+
+    def _rowcount(self, result, submitted):
+        """
+        Return the number of rows changed by an INSERT of submitted rows, if
+        the driver reports it reliably, else submitted.
+        """
+        dialect = self.session.get_bind().dialect
+        if submitted > 1:
+            sane = dialect.supports_sane_multi_rowcount
+        else:
+            sane = dialect.supports_sane_rowcount
+        if sane and result.rowcount >= 0:
+            return result.rowcount
+        return submitted
+
+    def _insert(self, table, columns):
+        """ Return an INSERT statement for table, upserting if so configured """
+        if self.on_conflict is None:
+            return table.insert()
+
+        dialect = self.session.get_bind().dialect
+        if dialect.name not in ('sqlite', 'postgresql'):
+            raise ValueError("Upsert isn't supported for %s" % dialect.name)
+        quote = dialect.identifier_preparer.quote
+
+        target = _conflict_target(table)
+        # Don't flip the discriminator of existing joined-inheritance rows
+        update = [c for c in columns
+                  if c not in target and c.key != 'subclass']
+        sql = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) ' % (
+            dialect.identifier_preparer.format_table(table),
+            ', '.join([quote(c.name) for c in columns]),
+            ', '.join([':%s' % c.key for c in columns]),
+            ', '.join([quote(c.name) for c in target]))
+        if self.on_conflict == 'update' and update:
+            sql += 'DO UPDATE SET %s' % ', '.join(
+                ['%s = excluded.%s' % (quote(c.name), quote(c.name))
+                 for c in update])
+            if 'subclass' in table.c:
+                # ... nor overwrite it with another subclass's attributes
+                sql += ' WHERE %s.%s = excluded.%s' % (
+                    dialect.identifier_preparer.format_table(table),
+                    quote('subclass'), quote('subclass'))
+        else:
+            sql += 'DO NOTHING'
+        # Bind with the column types, so e.g. OFXNumeric still converts
+        return text(sql).bindparams(
+            *[bindparam(c.key, type_=c.type) for c in columns])
+
+    @property
+    def rate(self):
+        """ Records inserted (or updated) per second """
+        return self.records / max(self.elapsed, 1e-6)
+
+    def __repr__(self):
+        return '<%s records=%d rows=%d elapsed=%.3fs rate=%.0f/s>' % (
+            self.__class__.__name__, self.records, self.rows, self.elapsed,
+            self.rate)
+
+
+def _is_surrogate(column):
+    """ Is column an autoincrementing integer primary key? """
+    return (column.primary_key and not column.foreign_keys
+            and isinstance(column.type, Integer)
+            and len(column.table.primary_key.columns) == 1)
+
+
+def _conflict_target(table):
+    """ Return the natural key columns of table, for ON CONFLICT """
+    if 'id' in table.c and _is_surrogate(table.c.id):
+        for constraint in table.constraints:
+            if isinstance(constraint, UniqueConstraint):
+                return list(constraint.columns)
+    return list(table.primary_key.columns)
+
+
+def _row(SubClass, attributes):
+    """
+    Convert flattened attributes to a dict of column values, replacing
+    relationships with their foreign keys and adding the polymorphic
+    discriminator.
+    """
+    mapper = class_mapper(SubClass)
+    row = {}
+    for key, value in attributes.items():
+        prop = mapper.relationships.get(key)
+        if prop is None:
+            row[key] = value
+        else:
+            for local, remote in prop.local_remote_pairs:
+                row[local.key] = getattr(value, remote.key)
+    if mapper.polymorphic_on is not None:
+        row[mapper.polymorphic_on.key] = mapper.polymorphic_identity
+    return row
+
+
+def _existing_keys(SubClass, keys):
+    """ Return the subset of the given primary key tuples already persisted """
+    # Query the base class, whose table holds the primary keys for
+    # joined-table inheritance, so as not to join the child table.
+    BaseClass = class_mapper(SubClass).base_mapper.class_
+    pks = BaseClass.primary_keys()
+    entities = [getattr(BaseClass, pk) for pk in pks]
+    return set([
+        tuple([_normalize(BaseClass, pk, value) for pk, value in zip(pks, row)])
+        for row in _query_fingerprints(BaseClass, keys, entities=entities)
+    ])
+
+
+def _surrogate_ids(SubClass, keys):
+    """
+    Map (SubClass, primary key tuple) to the surrogate id for newly inserted
+    rows of joined-inheritance parent tables.  Keys held by parent rows of a
+    different subclass (left in place by an upsert) are omitted.
+    """
+    # Child table rows don't exist yet; query the parent table only.
+    mapper = class_mapper(SubClass)
+    BaseClass = mapper.base_mapper.class_
+    pks = BaseClass.primary_keys()
+    entities = ([BaseClass.id, mapper.polymorphic_on] +
+                [getattr(BaseClass, pk) for pk in pks])
+    ids = {}
+    for row in _query_fingerprints(BaseClass, keys, entities=entities):
+        if row[1] != mapper.polymorphic_identity:
+            continue
+        key = tuple([_normalize(BaseClass, pk, value)
+                     for pk, value in zip(pks, row[2:])])
+        ids[(SubClass, key)] = row[0]
+    return ids
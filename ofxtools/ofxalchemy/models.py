@@ -4,6 +4,7 @@ SQLAlchemy object model for fundamental OFX data aggregates such as transactions
 balances, and securities.
 """
 # stdlib imports
+import hashlib
 import sqlite3
 
 
@@ -15,7 +16,9 @@ from sqlalchemy import (
     String,
     Text,
     ForeignKey,
+    Index,
     event,
+    inspect,
     )
 from sqlalchemy.engine import Engine
 from sqlalchemy.schema import (
@@ -64,6 +67,93 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
         cursor.close()
 
 
+# Opt-in SQLite settings for loading lots of data; see bulk_load_profile().
+# page_size must come first: it only takes effect on a new database, and
+# can't be changed after switching to WAL.
+BULK_LOAD_PRAGMAS = (
+    ('page_size', 32768),
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -262144),  # KiB, i.e. 256 MiB
+    ('temp_store', 'MEMORY'),
+)
+
+
+def bulk_load_profile(engine, pragmas=BULK_LOAD_PRAGMAS):
+    """
+    Configure all connections of a SQLite engine for bulk loading: write-
+    ahead logging, fsync only at checkpoints, a larger page cache and
+    in-memory temp tables.  Engines for other databases, and in-memory
+    SQLite databases, are left alone.
+
+    The pragmas are issued as each connection is opened, outside of any
+    transaction (SQLite ignores journal_mode/synchronous changes within a
+    transaction), and so apply to every transaction on that connection.
+    Connections already in the engine's pool are discarded.
+
+    Returns a handle whose restore() method (also called on leaving it as a
+    context manager) stops configuring new connections, discards the pooled
+    connections and switches the database back to its original journal
+    mode.  Close any sessions first; SQLite won't leave WAL mode while
+    other connections are open.  The page size of a new database can't be
+    changed back, and remains in the file.
+
+        with bulk_load_profile(engine):
+            ...  # load, commit & close the session
+    """
+    return _BulkLoadProfile(engine, pragmas)
+
+
+class _BulkLoadProfile(object):
+    """ Handle returned by bulk_load_profile() """
+    def __init__(self, engine, pragmas):
+        self.engine = engine
+        self.journal_mode = None
+        url = engine.url
+        if (engine.dialect.name != 'sqlite'
+                or url.database in (None, '', ':memory:')):
+            self.listener = None
+            return
+
+        connection = engine.connect()
+        try:
+            self.journal_mode = connection.execute(
+                'PRAGMA journal_mode').scalar()
+        finally:
+            connection.close()
+
+        def set_bulk_load_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas:
+                cursor.execute("PRAGMA %s=%s" % (name, value))
+            cursor.close()
+
+        self.listener = set_bulk_load_pragmas
+        event.listen(engine, "connect", self.listener)
+        engine.dispose()
+
+    def restore(self):
+        """ Undo bulk_load_profile() """
+        if self.listener is None:
+            return
+        event.remove(self.engine, "connect", self.listener)
+        self.listener = None
+        # synchronous, cache_size etc. are per-connection settings, which
+        # go away with the connections; journal_mode is kept in the file.
+        self.engine.dispose()
+        connection = self.engine.connect()
+        try:
+            connection.execute('PRAGMA journal_mode=%s' % self.journal_mode)
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.restore()
+
+
 ### OBJECT CLASSES
 @as_declarative()
 class Base(object):
@@ -900,3 +990,89 @@ class POSSTOCK(INVPOS):
     unitsstreet = Column(OFXNumeric())
     unitsuser = Column(OFXNumeric())
     reinvdiv = Column(OFXBoolean())
+
+
+### INGESTION LEDGER
+class INGESTION(Base):
+    """
+    Synthetic ledger of the OFX files loaded into the database - not in OFX
+    spec.
+
+    Keyed by a hash of the file contents, so that files which have already
+    been ingested can be skipped without parsing them again.
+    """
+    digest = Column(String(length=64), primary_key=True)
+    newfileuid = Column(String(length=36))
+    org = Column(String(length=32))
+    fid = Column(String(length=32))
+    # Account of the first statement in the file, if any
+    acctfrom_id = Column(
+        Integer, ForeignKey('acctfrom.id',
+                            onupdate='CASCADE', ondelete='SET NULL'))
+    acctfrom = relationship('ACCTFROM')
+    dtingested = Column(OFXDateTime, nullable=False)
+
+    @staticmethod
+    def hash_file(filename, chunksize=65536):
+        """ Return the hex SHA-256 digest of a file's contents """
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunksize), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @classmethod
+    def is_ingested(cls, digest):
+        """ Has the file with the given digest been recorded already? """
+        return DBSession.query(cls).get(digest) is not None
+
+
+### INDEXES
+# Secondary indexes for the common access patterns: date ranges per account,
+# history per security, and lookups by payee/destination account.  Natural
+# keys are already indexed by their primary key/uniqueness constraints.
+INDEXES = [
+    Index('ix_stmttrn_acctfrom_dtposted',
+          STMTTRN.__table__.c.acctfrom_id, STMTTRN.__table__.c.dtposted),
+    Index('ix_stmttrn_payee_name', STMTTRN.__table__.c.payee_name),
+    Index('ix_stmttrn_acctto_id', STMTTRN.__table__.c.acctto_id),
+    Index('ix_invbanktran_acctfrom_dtposted',
+          INVBANKTRAN.__table__.c.acctfrom_id,
+          INVBANKTRAN.__table__.c.dtposted),
+    Index('ix_invbanktran_payee_name', INVBANKTRAN.__table__.c.payee_name),
+    Index('ix_invbanktran_acctto_id', INVBANKTRAN.__table__.c.acctto_id),
+    Index('ix_invtran_acctfrom_dttrade',
+          INVTRAN.__table__.c.acctfrom_id, INVTRAN.__table__.c.dttrade),
+    Index('ix_invtran_dttrade', INVTRAN.__table__.c.dttrade),
+    Index('ix_invpos_acctfrom_dtasof',
+          INVPOS.__table__.c.acctfrom_id, INVPOS.__table__.c.dtasof),
+    Index('ix_invpos_secinfo_dtasof',
+          INVPOS.__table__.c.secinfo_id, INVPOS.__table__.c.dtasof),
+]
+# Security references held in the child tables of INVTRAN subclasses
+INDEXES.extend([
+    Index('ix_%s_secinfo_id' % table.name, table.c.secinfo_id)
+    for table in Base.metadata.sorted_tables
+    if 'secinfo_id' in table.c and table is not INVPOS.__table__
+])
+
+
+def create_indexes(bind):
+    """
+    Create any of INDEXES that are missing from an existing database (new
+    databases get them from Base.metadata.create_all()).
+
+    Returns the names of the indexes created.
+    """
+    inspector = inspect(bind)
+    created = []
+    existing = {}
+    for index in INDEXES:
+        table = index.table.name
+        if table not in existing:
+            existing[table] = set([ix['name']
+                                   for ix in inspector.get_indexes(table)])
+        if index.name not in existing[table]:
+            index.create(bind)
+            created.append(index.name)
+    return created
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8
+"""
+Local stand-in for an OFX server, for testing & benchmarking OFXClient
+without talking to a real financial institution.
+
+OFXServer accepts the requests composed by OFXClient.statement_request() and
+OFXClient.profile_request(), and answers with synthetic OFXv2 responses:
+statements of a configurable number of transactions, after a configurable
+latency, failing with HTTP 500 at a configurable rate.
+"""
+
+# stdlib imports
+import sys
+import datetime
+import random
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from decimal import Decimal
+
+PYTHON_VERSION = sys.version_info.major
+
+if PYTHON_VERSION == 3:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+else:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+
+# local imports
+from ofxtools.header import OFXHeader
+from ofxtools.types import DateTime
+
+
+# Statement request tag => (statement response tag, transaction list tag)
+STMTRQ_TAGS = {'STMTRQ': ('STMTRS', 'BANKTRANLIST'),
+               'CCSTMTRQ': ('CCSTMTRS', 'BANKTRANLIST'),
+               'INVSTMTRQ': ('INVSTMTRS', 'INVTRANLIST'),
+              }
+
+TRNTYPES = ('CREDIT', 'DEBIT', 'INT', 'DIV', 'FEE', 'SRVCHG', 'DEP', 'ATM',
+            'POS', 'XFER', 'CHECK', 'PAYMENT', 'CASH', 'DIRECTDEP',
+            'DIRECTDEBIT', 'REPEATPMT', 'OTHER')
+
+
+class OFXRequestHandler(BaseHTTPRequestHandler):
+    """ Answer POSTed OFX requests with OFXServer.respond() """
+    # Keep connections alive, for clients using a ConnectionPool
+    protocol_version = 'HTTP/1.1'
+    # Headers & body are sent separately; with Nagle's algorithm, each
+    # response on a kept-alive connection would wait for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = self.rfile.read(length)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.fail():
+            self.send_error(500)
+            return
+        try:
+            body = self.server.respond(request)
+        except (ValueError, SyntaxError) as err:
+            self.send_error(400, str(err))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ofx')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+
+class OFXServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server answering OFX requests with synthetic responses.
+
+    transactions is the number of transactions in each statement; latency
+    is the time (in seconds) to wait before answering each request;
+    error_rate is the fraction of requests (0 to 1) answered with HTTP 500.
+    seed makes the errors and the statement contents reproducible.
+
+    Statements are generated once per account, then cached, so the
+    server's own overhead stays low while benchmarking the client.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    # Default of 5 drops connections when benchmarking many client threads
+    request_queue_size = 128
+
+    def __init__(self, address=('127.0.0.1', 0), transactions=100, latency=0,
+                 error_rate=0, seed=None, verbose=False):
+        HTTPServer.__init__(self, address, OFXRequestHandler)
+        self.transactions = transactions
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.verbose = verbose
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    def start(self):
+        """ Serve requests in a background thread; return self """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop serving & close the socket """
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def fail(self):
+        """ Count a request; decide whether to answer it with an error """
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return failed
+
+    def respond(self, request):
+        """
+        Given an OFX request (bytes, with OFX header), return the OFXv2
+        response (bytes, with OFX header).
+        """
+        start = request.find(b'<OFX>')
+        if start < 0:
+            raise ValueError("Can't find OFX request body")
+        ofx = ET.fromstring(request[start:])
+
+        # DateTime.unconvert() takes local time, and converts it to GMT
+        now = _dt(datetime.datetime.now())
+        body = [b'<OFX>', b'<SIGNONMSGSRSV1><SONRS>', _status(),
+                _tag('DTSERVER', now), _tag('LANGUAGE', 'ENG')]
+        fi = ofx.find('SIGNONMSGSRQV1/SONRQ/FI')
+        if fi is not None:
+            body.append(ET.tostring(fi))
+        body.append(b'</SONRS></SIGNONMSGSRSV1>')
+
+        for msgsrq in ofx:
+            if msgsrq.tag == 'SIGNONMSGSRQV1':
+                continue
+            msgsrs = msgsrq.tag.replace('RQV', 'RSV')
+            body.append(_tag(msgsrs, None))
+            for trnrq in msgsrq:
+                rq = trnrq[-1]
+                trnrs = rq.tag.replace('RQ', 'TRNRS')
+                body.extend([_tag(trnrs, None),
+                             _tag('TRNUID', trnrq.findtext('TRNUID')),
+                             _status()])
+                if rq.tag in STMTRQ_TAGS:
+                    body.append(self.statement(rq))
+                elif rq.tag == 'PROFRQ':
+                    body.append(self.profile())
+                else:
+                    raise ValueError('Unsupported request %s' % rq.tag)
+                body.append(_tag(trnrs, None, close=True))
+            body.append(_tag(msgsrs, None, close=True))
+        body.append(b'</OFX>')
+
+        header = str(OFXHeader(version=200, newfileuid=uuid.uuid4()))
+        return (header + '\r\n').encode('ascii') + b''.join(body)
+
+    def statement(self, stmtrq):
+        """ Return the (cached) *STMTRS for a *STMTRQ Element, as bytes """
+        acctfrom = stmtrq[0]
+        key = (stmtrq.tag, ET.tostring(acctfrom))
+        with self._lock:
+            stmtrs = self._statements.get(key)
+        if stmtrs is None:
+            stmtrs = self._make_statement(stmtrq.tag, acctfrom)
+            with self._lock:
+                self._statements[key] = stmtrs
+        return stmtrs
+
+    def _make_statement(self, tag, acctfrom):
+        stmtrs_tag, tranlist_tag = STMTRQ_TAGS[tag]
+        # Seed per account, so statements don't depend on request order
+        rand = random.Random('%s%s' % (self.seed, ET.tostring(acctfrom)))
+        dtstart = datetime.datetime(2005, 1, 1)
+        dtend = dtstart + datetime.timedelta(hours=self.transactions)
+
+        stmtrs = ET.Element(stmtrs_tag)
+        if tag == 'INVSTMTRQ':
+            ET.SubElement(stmtrs, 'DTASOF').text = _dt(dtend)
+        ET.SubElement(stmtrs, 'CURDEF').text = 'USD'
+        stmtrs.append(acctfrom)
+        tranlist = ET.SubElement(stmtrs, tranlist_tag)
+        ET.SubElement(tranlist, 'DTSTART').text = _dt(dtstart)
+        ET.SubElement(tranlist, 'DTEND').text = _dt(dtend)
+        balance = Decimal('0.00')
+        for n in range(self.transactions):
+            amount = Decimal(rand.randint(-100000, 100000)) / 100
+            balance += amount
+            stmttrn = ET.Element('STMTTRN')
+            ET.SubElement(stmttrn, 'TRNTYPE').text = rand.choice(TRNTYPES)
+            ET.SubElement(stmttrn, 'DTPOSTED').text = _dt(
+                dtstart + datetime.timedelta(hours=n))
+            ET.SubElement(stmttrn, 'TRNAMT').text = str(amount)
+            ET.SubElement(stmttrn, 'FITID').text = '%08d' % n
+            ET.SubElement(stmttrn, 'NAME').text = 'Payee %d' % rand.randint(
+                1, 1000)
+            if tranlist_tag == 'INVTRANLIST':
+                invbanktran = ET.SubElement(tranlist, 'INVBANKTRAN')
+                invbanktran.append(stmttrn)
+                ET.SubElement(invbanktran, 'SUBACCTFUND').text = 'CASH'
+            else:
+                tranlist.append(stmttrn)
+
+        if tag == 'INVSTMTRQ':
+            invbal = ET.SubElement(stmtrs, 'INVBAL')
+            for balance_tag in ('AVAILCASH', 'MARGINBALANCE', 'SHORTBALANCE'):
+                ET.SubElement(invbal, balance_tag).text = str(balance)
+        else:
+            ledgerbal = ET.SubElement(stmtrs, 'LEDGERBAL')
+            ET.SubElement(ledgerbal, 'BALAMT').text = str(balance)
+            ET.SubElement(ledgerbal, 'DTASOF').text = _dt(dtend)
+        return ET.tostring(stmtrs)
+
+    def profile(self):
+        """ Return a minimal PROFRS, as bytes """
+        profrs = ET.Element('PROFRS')
+        msgsetlist = ET.SubElement(profrs, 'MSGSETLIST')
+        for msgset in ('SIGNONMSGSET', 'BANKMSGSET', 'CREDITCARDMSGSET',
+                       'INVSTMTMSGSET'):
+            ET.SubElement(msgsetlist, msgset)
+        signoninfolist = ET.SubElement(profrs, 'SIGNONINFOLIST')
+        signoninfo = ET.SubElement(signoninfolist, 'SIGNONINFO')
+        ET.SubElement(signoninfo, 'SIGNONREALM').text = 'STANDIN'
+        ET.SubElement(profrs, 'DTPROFUP').text = _dt(
+            datetime.datetime(2005, 1, 1))
+        ET.SubElement(profrs, 'FINAME').text = 'OFX stand-in server'
+        return ET.tostring(profrs)
+
+
+def _dt(value):
+    return DateTime().unconvert(value)
+
+
+def _status():
+    return b'<STATUS><CODE>0</CODE><SEVERITY>INFO</SEVERITY></STATUS>'
+
+
+def _tag(tag, text, close=False):
+    """ Return an opening or closing tag, or a whole element if text is given """
+    if close:
+        return ('</%s>' % tag).encode('ascii')
+    if text is None:
+        return ('<%s>' % tag).encode('ascii')
+    return ('<%s>%s</%s>' % (tag, text, tag)).encode('ascii')
+
+
+def main():
+    from argparse import ArgumentParser
+
+    argparser = ArgumentParser(description='Run a local OFX stand-in server')
+    argparser.add_argument('--host', default='127.0.0.1')
+    argparser.add_argument('-p', '--port', type=int, default=8000)
+    argparser.add_argument('-n', '--transactions', type=int, default=100,
+                           help='Transactions per statement')
+    argparser.add_argument('--latency', type=float, default=0,
+                           help='Seconds to wait before each response')
+    argparser.add_argument('--error-rate', type=float, default=0,
+                           help='Fraction of requests answered with HTTP 500')
+    argparser.add_argument('--seed', type=int, default=None)
+    args = argparser.parse_args()
+
+    server = OFXServer((args.host, args.port), transactions=args.transactions,
+                       latency=args.latency, error_rate=args.error_rate,
+                       seed=args.seed, verbose=True)
+    print('Serving OFX on %s' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
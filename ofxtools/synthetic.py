@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8
+"""
+Generate synthetic OFX documents of arbitrary size, for benchmarking the
+parser and the ofxalchemy loader.
+
+OFXGenerator writes OFXv1 (SGML, optionally without closing tags for
+elements) or OFXv2 (XML) statements with a configurable number of accounts,
+transactions, securities and positions, and mix of transaction types.
+Output is produced chunk by chunk, so multi-GB files can be written without
+holding the document in memory, and it's fully determined by the seed.
+"""
+
+# stdlib imports
+import bisect
+import datetime
+import random
+
+
+# local imports
+from ofxtools.header import OFXHeader
+from ofxtools.models import INVSUBACCTS, INCOMETYPES
+
+
+# Default transaction type mix (type: relative weight) for each kind of
+# account.  For bank & credit card accounts the types are STMTTRN TRNTYPEs;
+# for investment accounts they're INVTRANLIST aggregates.
+TRNTYPES = {
+    'bank': {'CHECK': 4, 'DEBIT': 4, 'POS': 6, 'ATM': 2, 'CREDIT': 2,
+             'DIRECTDEP': 1, 'XFER': 1, 'SRVCHG': 1},
+    'creditcard': {'DEBIT': 10, 'PAYMENT': 1, 'CREDIT': 1, 'FEE': 1},
+    'investment': {'BUYSTOCK': 3, 'SELLSTOCK': 2, 'INCOME': 2,
+                   'INVBANKTRAN': 3},
+}
+
+# Kind of account => (message set, TRNRS, STMTRS, ACCTFROM, TRANLIST) tags
+STATEMENT_TAGS = {
+    'bank': ('BANKMSGSRSV1', 'STMTTRNRS', 'STMTRS', 'BANKACCTFROM',
+             'BANKTRANLIST'),
+    'creditcard': ('CREDITCARDMSGSRSV1', 'CCSTMTTRNRS', 'CCSTMTRS',
+                   'CCACCTFROM', 'BANKTRANLIST'),
+    'investment': ('INVSTMTMSGSRSV1', 'INVSTMTTRNRS', 'INVSTMTRS',
+                   'INVACCTFROM', 'INVTRANLIST'),
+}
+
+INVTRAN_TYPES = ('BUYSTOCK', 'SELLSTOCK', 'INCOME', 'INVBANKTRAN')
+
+
+class OFXGenerator(object):
+    """
+    Synthetic OFX document generator.
+
+    accounts is the number of statements, each of kind acctkind ('bank',
+    'creditcard' or 'investment'), holding the given number of
+    transactions.  Investment statements also hold the given number of
+    positions, referring to the securities listed in SECLIST.
+
+    trntypes maps transaction types to relative weights (see TRNTYPES for
+    the defaults).  For OFXv1 (version 1xx), closing_tags=False omits the end
+    tags of data-bearing elements, as many FIs do.
+
+    Only random.random() is used to draw values, so a given seed produces
+    the same document under Python 2 & 3.  FITIDs include the seed, so
+    documents with different seeds can be loaded together.
+    """
+    # Approximate size (in characters) of the chunks yielded by chunks()
+    chunksize = 65536
+
+    def __init__(self, accounts=1, transactions=100, securities=0,
+                 positions=0, acctkind='bank', trntypes=None, version=102,
+                 closing_tags=True, seed=0):
+        if acctkind not in STATEMENT_TAGS:
+            raise ValueError("acctkind must be one of %s, not '%s'"
+                             % (sorted(STATEMENT_TAGS), acctkind))
+        trntypes = trntypes or TRNTYPES[acctkind]
+        if acctkind == 'investment':
+            for trntype in trntypes:
+                if trntype not in INVTRAN_TYPES:
+                    raise ValueError("Unsupported investment transaction '%s'"
+                                     % trntype)
+            needs_secid = positions or [t for t, weight in trntypes.items()
+                                        if t != 'INVBANKTRAN' and weight]
+            if needs_secid and not securities:
+                raise ValueError('Investment transactions & positions need '
+                                 'at least one security')
+            if positions > securities:
+                # Each position is for a different security
+                raise ValueError('More positions (%d) than securities (%d)'
+                                 % (positions, securities))
+        elif positions:
+            raise ValueError('Only investment statements have positions')
+        if not closing_tags and version >= 200:
+            raise ValueError('OFXv2 (XML) requires closing tags')
+
+        self.accounts = accounts
+        self.transactions = transactions
+        self.securities = securities
+        self.positions = positions
+        self.acctkind = acctkind
+        self.trntypes = trntypes
+        self.version = version
+        self.closing_tags = closing_tags
+        self.seed = seed
+
+    def write(self, dest):
+        """
+        Write the document to dest (a filename, or a file object opened in
+        binary mode); return the number of bytes written.
+        """
+        if hasattr(dest, 'write'):
+            return self._write(dest)
+        with open(dest, 'wb') as f:
+            return self._write(f)
+
+    def _write(self, f):
+        size = 0
+        for chunk in self.chunks():
+            chunk = chunk.encode('ascii')
+            f.write(chunk)
+            size += len(chunk)
+        return size
+
+    def chunks(self):
+        """ Yield the document (including OFX header) as a series of str """
+        self._random = random.Random(self.seed)
+        # Sort so the weights don't depend on dict ordering
+        types = sorted(self.trntypes.items())
+        self._types = [trntype for trntype, weight in types]
+        self._weights = []
+        total = 0
+        for trntype, weight in types:
+            total += weight
+            self._weights.append(total)
+
+        header = str(OFXHeader(version=self.version,
+                               newfileuid='SYNTHETIC%d' % self.seed))
+        if self.version >= 200:
+            header += '\r\n'
+        buf = [header]
+        size = len(header)
+        for part in self._document():
+            buf.append(part)
+            size += len(part)
+            if size >= self.chunksize:
+                yield ''.join(buf)
+                buf = []
+                size = 0
+        if buf:
+            yield ''.join(buf)
+
+    def _document(self):
+        """ Yield the OFX body, roughly one aggregate at a time """
+        msgsrs, trnrs, stmtrs, acctfrom, tranlist = STATEMENT_TAGS[
+            self.acctkind]
+        dtserver = _dt(datetime.datetime(2015, 1, 1))
+        yield ('<OFX>\n<SIGNONMSGSRSV1>\n<SONRS>\n' + self._status() +
+               self._leaf('DTSERVER', dtserver) + self._leaf('LANGUAGE', 'ENG') +
+               '</SONRS>\n</SIGNONMSGSRSV1>\n<%s>\n' % msgsrs)
+
+        for n in range(self.accounts):
+            yield ('<%s>\n' % trnrs + self._leaf('TRNUID', n + 1) +
+                   self._status() + '<%s>\n' % stmtrs)
+            if self.acctkind == 'investment':
+                yield self._leaf('DTASOF', dtserver)
+            yield self._leaf('CURDEF', 'USD') + self._acctfrom(acctfrom, n)
+            for part in self._tranlist(tranlist):
+                yield part
+            if self.acctkind == 'investment':
+                yield '<INVPOSLIST>\n'
+                for m in range(self.positions):
+                    yield self._position(m)
+                yield ('</INVPOSLIST>\n<INVBAL>\n' +
+                       self._leaf('AVAILCASH', self._amount()) +
+                       self._leaf('MARGINBALANCE', '0.00') +
+                       self._leaf('SHORTBALANCE', '0.00') + '</INVBAL>\n')
+            else:
+                yield ('<LEDGERBAL>\n' +
+                       self._leaf('BALAMT', self._amount()) +
+                       self._leaf('DTASOF', dtserver) + '</LEDGERBAL>\n')
+            yield '</%s>\n</%s>\n' % (stmtrs, trnrs)
+        yield '</%s>\n' % msgsrs
+
+        if self.securities:
+            yield '<SECLISTMSGSRSV1>\n<SECLIST>\n'
+            for n in range(self.securities):
+                yield ('<STOCKINFO>\n<SECINFO>\n' + self._secid(n) +
+                       self._leaf('SECNAME', 'Security %d' % n) +
+                       self._leaf('TICKER', 'SEC%d' % n) +
+                       '</SECINFO>\n</STOCKINFO>\n')
+            yield '</SECLIST>\n</SECLISTMSGSRSV1>\n'
+        yield '</OFX>\n'
+
+    def _tranlist(self, tag):
+        start = datetime.datetime(2014, 1, 1)
+        end = start + datetime.timedelta(minutes=self.transactions)
+        yield ('<%s>\n' % tag + self._leaf('DTSTART', _dt(start)) +
+               self._leaf('DTEND', _dt(end)))
+        for n in range(self.transactions):
+            trntype = self._types[bisect.bisect_right(
+                self._weights, self._random.random() * self._weights[-1])]
+            dt = _dt(start + datetime.timedelta(minutes=n))
+            if self.acctkind == 'investment':
+                yield self._invtran(trntype, n, dt)
+            else:
+                yield self._stmttrn(trntype, n, dt)
+        yield '</%s>\n' % tag
+
+    def _stmttrn(self, trntype, n, dt):
+        return ('<STMTTRN>\n' + self._leaf('TRNTYPE', trntype) +
+                self._leaf('DTPOSTED', dt) +
+                self._leaf('TRNAMT', self._amount()) +
+                self._leaf('FITID', self._fitid(n)) +
+                self._leaf('NAME', 'Payee %d' % self._randint(1000)) +
+                '</STMTTRN>\n')
+
+    def _invtran(self, trntype, n, dt):
+        if trntype == 'INVBANKTRAN':
+            return ('<INVBANKTRAN>\n' +
+                    self._stmttrn(('CREDIT', 'DEBIT')[self._randint(2)], n, dt) +
+                    self._leaf('SUBACCTFUND', 'CASH') + '</INVBANKTRAN>\n')
+
+        invtran = ('<INVTRAN>\n' + self._leaf('FITID', self._fitid(n)) +
+                   self._leaf('DTTRADE', dt) + '</INVTRAN>\n' +
+                   self._secid(self._randint(self.securities)))
+        subaccts = (self._leaf('SUBACCTSEC', self._choice(INVSUBACCTS)) +
+                    self._leaf('SUBACCTFUND', 'CASH'))
+        if trntype == 'INCOME':
+            return ('<INCOME>\n' + invtran +
+                    self._leaf('INCOMETYPE', self._choice(INCOMETYPES)) +
+                    self._leaf('TOTAL', self._amount(positive=True)) +
+                    subaccts + '</INCOME>\n')
+
+        units = 1 + self._randint(1000)
+        unitprice = self._amount(positive=True)
+        total = '%.2f' % (units * float(unitprice))
+        if trntype == 'BUYSTOCK':
+            wrapper, aggregate, kind, value = ('BUYSTOCK', 'INVBUY',
+                                               'BUYTYPE', 'BUY')
+        else:
+            wrapper, aggregate, kind, value = ('SELLSTOCK', 'INVSELL',
+                                               'SELLTYPE', 'SELL')
+            # Sales reduce holdings
+            units = -units
+        return ('<%s>\n<%s>\n' % (wrapper, aggregate) + invtran +
+                self._leaf('UNITS', units) +
+                self._leaf('UNITPRICE', unitprice) +
+                self._leaf('TOTAL', total) + subaccts +
+                '</%s>\n' % aggregate + self._leaf(kind, value) +
+                '</%s>\n' % wrapper)
+
+    def _position(self, n):
+        units = 1 + self._randint(10000)
+        unitprice = self._amount(positive=True)
+        return ('<POSSTOCK>\n<INVPOS>\n' +
+                self._secid(n) +
+                self._leaf('HELDINACCT', 'CASH') +
+                self._leaf('POSTYPE', 'LONG') + self._leaf('UNITS', units) +
+                self._leaf('UNITPRICE', unitprice) +
+                self._leaf('MKTVAL', '%.2f' % (units * float(unitprice))) +
+                self._leaf('DTPRICEASOF', _dt(datetime.datetime(2015, 1, 1))) +
+                '</INVPOS>\n</POSSTOCK>\n')
+
+    def _acctfrom(self, tag, n):
+        acctid = self._leaf('ACCTID', '%010d' % (n + 1))
+        if self.acctkind == 'bank':
+            acct = (self._leaf('BANKID', '121099999') + acctid +
+                    self._leaf('ACCTTYPE', 'CHECKING'))
+        elif self.acctkind == 'investment':
+            acct = self._leaf('BROKERID', 'example.com') + acctid
+        else:
+            acct = acctid
+        return '<%s>\n%s</%s>\n' % (tag, acct, tag)
+
+    def _fitid(self, n):
+        # Account IDs are the same for every seed, so mix the seed into the
+        # FITID to keep documents generated with different seeds (and hence
+        # different transaction types) from colliding on (account, FITID)
+        # when loaded into the same database.
+        return '%d-%010d' % (self.seed, n)
+
+    def _secid(self, n):
+        return ('<SECID>\n' + self._leaf('UNIQUEID', '%09d' % n) +
+                self._leaf('UNIQUEIDTYPE', 'CUSIP') + '</SECID>\n')
+
+    def _status(self):
+        return ('<STATUS>\n' + self._leaf('CODE', 0) +
+                self._leaf('SEVERITY', 'INFO') + '</STATUS>\n')
+
+    def _leaf(self, tag, value):
+        if self.closing_tags:
+            return '<%s>%s</%s>\n' % (tag, value, tag)
+        return '<%s>%s\n' % (tag, value)
+
+    def _randint(self, n):
+        """ Return a random int 0 <= i < n """
+        return int(self._random.random() * n)
+
+    def _choice(self, seq):
+        return seq[self._randint(len(seq))]
+
+    def _amount(self, positive=False):
+        value = self._random.random() * 1000
+        if not positive:
+            value -= 500
+        return '%.2f' % value
+
+
+def _dt(value):
+    return value.strftime('%Y%m%d%H%M%S')
+
+
+def main():
+    from argparse import ArgumentParser
+
+    argparser = ArgumentParser(description='Write a synthetic OFX file')
+    argparser.add_argument('output', help='Output filename')
+    argparser.add_argument('-a', '--accounts', type=int, default=1)
+    argparser.add_argument('-t', '--transactions', type=int, default=100,
+                           help='Transactions per account')
+    argparser.add_argument('-s', '--securities', type=int, default=0)
+    argparser.add_argument('-p', '--positions', type=int, default=0,
+                           help='Positions per account')
+    argparser.add_argument('-k', '--acctkind', default='bank',
+                           choices=sorted(STATEMENT_TAGS))
+    argparser.add_argument('--trntypes', default=None,
+                           help='Transaction type mix, e.g. CHECK=3,ATM=1')
+    argparser.add_argument('-v', '--version', type=int, default=102,
+                           help='OFX version (1xx for SGML, 2xx for XML)')
+    argparser.add_argument('--no-closing-tags', dest='closing_tags',
+                           action='store_false',
+                           help='Omit OFXv1 element end tags')
+    argparser.add_argument('--seed', type=int, default=0)
+    args = argparser.parse_args()
+
+    trntypes = None
+    if args.trntypes:
+        trntypes = {}
+        for item in args.trntypes.split(','):
+            trntype, weight = item.split('=')
+            trntypes[trntype.strip().upper()] = float(weight)
+
+    generator = OFXGenerator(accounts=args.accounts,
+                             transactions=args.transactions,
+                             securities=args.securities,
+                             positions=args.positions,
+                             acctkind=args.acctkind, trntypes=trntypes,
+                             version=args.version,
+                             closing_tags=args.closing_tags, seed=args.seed)
+    size = generator.write(args.output)
+    print('Wrote %d bytes to %s' % (size, args.output))
+
+
+if __name__ == '__main__':
+    main()
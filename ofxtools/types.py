@@ -2,13 +2,16 @@
 """ OFX element type converters / validators """
 
 # stdlib imports
-from weakref import WeakKeyDictionary
 import decimal
 import datetime
 import time
 import re
 
 
+# local imports
+from ofxtools.utils import LRUCache
+
+
 class Element(object):
     """
     Python representation of an OFX 'element', i.e. SGML leaf node that contains
@@ -18,16 +21,12 @@ class Element(object):
     required vs. optional, etc.) as arguments to __init__() when defining
     an Aggregate subclass.
 
-    Element instances are data descriptors that perform validation (using the
-    arguments passed to __init__()) and type conversion (using the logic
-    implemented in convert()) prior to setting the instance data value.
+    Element instances perform validation (using the arguments passed to
+    __init__()) and type conversion (using the logic implemented in convert())
+    of values set on Aggregate instances, which store the converted values
+    in slots (see ofxtools.models.AggregateMeta).
     """
     def __init__(self, *args, **kwargs):
-        # All instances of an Aggregate subclass share the same Element
-        # instance, so we have to have to handle the instance accounting
-        # here in the self.data dictionary.
-        # We use WeakKeyDictionary to facilitate memory garbage collection.
-        self.data = WeakKeyDictionary()
         self.required = kwargs.pop('required', False)
         self._init(*args, **kwargs)
 
@@ -41,14 +40,6 @@ class Element(object):
         """ Override in subclass """
         raise NotImplementedError
 
-    def __get__(self, instance, type_):
-        return self.data[instance]
-
-    def __set__(self, instance, value):
-        """ Perform validation and type conversion before setting value """
-        value = self.convert(value)
-        self.data[instance] = value
-
 
 class Bool(Element):
     mapping = {'Y': True, 'N': False}
@@ -183,6 +174,11 @@ class DateTime(Element):
         18: '%Y%m%d%H%M%S.%f', 14: '%Y%m%d%H%M%S', 12: '%Y%m%d%H%M', 8: '%Y%m%d'
     }
 
+    # OFX files repeat the same timestamps many times over (e.g. DTPOSTED
+    # for every transaction settling on a given day), so remember converted
+    # values, keyed by the input string.  Shared by all DateTime instances.
+    cache = LRUCache(maxsize=4096)
+
     def convert(self, value):
         if value is None:
             if self.required:
@@ -201,12 +197,26 @@ class DateTime(Element):
             raise ValueError("'%s' is type '%s'; can't convert to datetime" %
                             (value, type(value)))
 
+        try:
+            return self.cache[value]
+        except KeyError:
+            pass
+        converted = self._convert(value)
+        self.cache[value] = converted
+        return converted
+
+    def _convert(self, value):
+        """ Parse an OFX datetime string """
         # Pristine copy of input for error reporting purposes
         orig_value = value
 
         # Strip out timezone, on which strptime() chokes
-        chunks = self.tz_re.split(value)
-        value = chunks.pop(0)
+        if '[' in value:
+            chunks = self.tz_re.split(value)
+            value = chunks.pop(0)
+        else:
+            # No timezone; skip the regex
+            chunks = None
         if chunks:
             gmt_offset, tz_name = chunks[:2]
             # Some FIs *cough* IBKR *cough* write crap for the TZ offset
@@ -217,26 +227,38 @@ class DateTime(Element):
             gmt_offset = 0
 
         try:
-            format = self.formats[len(value)]
-        except KeyError:
-            raise ValueError("Datetime '%s' does not match OFX formats %s" %
-                            (orig_value, self.formats.values()))
-
-        # OFX spec gives fractional seconds as milliseconds; convert to
-        # microseconds as required by strptime()
-        if len(value) == 18:
-            value = value.replace('.', '.000')
-
-        try:
-            value = datetime.datetime.strptime(value, format)
+            value = self._parse(value)
         except ValueError:
             raise ValueError("Datetime '%s' does not match OFX formats %s" %
                             (orig_value, self.formats.values()))
 
         # Adjust timezone to GMT
-        value -= datetime.timedelta(seconds=gmt_offset)
+        if gmt_offset:
+            value -= datetime.timedelta(seconds=gmt_offset)
         return value
 
+    def _parse(self, value):
+        """
+        Parse a datetime string (sans timezone) in one of the fixed-width
+        formats, by slicing out the fields rather than calling strptime().
+        """
+        length = len(value)
+        if length not in self.formats:
+            raise ValueError
+        digits = value
+        if length == 18:
+            if value[14] != '.':
+                raise ValueError
+            digits = value[:14] + value[15:]
+        if not digits.isdigit():
+            raise ValueError
+        # N.B. the fractional seconds are read as microseconds, consistent
+        # with the strptime() based conversion this replaces.
+        return datetime.datetime(
+            int(digits[0:4]), int(digits[4:6]), int(digits[6:8]),
+            int(digits[8:10] or 0), int(digits[10:12] or 0),
+            int(digits[12:14] or 0), int(digits[14:] or 0))
+
     def unconvert(self, value):
         """
         Input datetime.date or datetime.datetime in local time; output str in GMT.
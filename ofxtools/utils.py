@@ -5,6 +5,8 @@
 import datetime
 import calendar
 import os
+import threading
+from collections import OrderedDict, namedtuple
 
 # local imports
 from ofxtools.lib import NUMBERING_AGENCIES
@@ -197,6 +199,57 @@ class NYSEcalendar(object):
         return hols
 
 
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class LRUCache(object):
+    """
+    Bounded mapping that discards the least recently used items, and counts
+    cache hits & misses (like functools.lru_cache, which Python 2 lacks).
+
+    Safe to share between threads (e.g. parsing concurrent downloads); the
+    pure-Python OrderedDict of Python 2 isn't.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                # Move to the most recently used end
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._data))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+
 def findEaster(year):
     """
     Copyright (c) 2003  Gustavo Niemeyer <niemeyer@conectiva.com>
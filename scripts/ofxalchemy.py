@@ -5,10 +5,16 @@ from __future__ import print_function
 
 import argparse
 import sys
+import time
 
 from sqlalchemy import create_engine
 
-from ofxtools.ofxalchemy import Base, DBSession, OFXParser
+from ofxtools.ofxalchemy import Base, DBSession, OFXParser, BulkLoader
+from ofxtools.ofxalchemy.models import (
+    INGESTION,
+    bulk_load_profile,
+    create_indexes,
+)
 
 
 def log(message, end='\n'):
@@ -23,18 +29,66 @@ if __name__ == '__main__':
     parser.add_argument('-v', '--verbose', action='store_true')
     parser.add_argument('--output', default='sqlite:///test.db',
                         help='Destination database URI')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Look up existing rows in bulk, not one by one')
+    parser.add_argument('--bulk-insert', action='store_true',
+                        help='Insert transactions & positions with executemany '
+                             'instead of the ORM')
+    parser.add_argument('--upsert', choices=('nothing', 'update'),
+                        help='With --bulk-insert, upsert rows with ON CONFLICT '
+                             'DO NOTHING/UPDATE (SQLite or PostgreSQL)')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='Reload files that have already been ingested')
+    parser.add_argument('--create-indexes', action='store_true',
+                        help='Add any missing secondary indexes to an '
+                             'existing database')
+    parser.add_argument('--sqlite-bulk', action='store_true',
+                        help='Tune SQLite connections for bulk loading '
+                             '(WAL, synchronous=NORMAL, bigger cache)')
     args = parser.parse_args()
+    if args.upsert and not args.bulk_insert:
+        parser.error('--upsert requires --bulk-insert')
 
     # DB setup
     engine = create_engine(args.output, echo=args.verbose)
+    profile = bulk_load_profile(engine) if args.sqlite_bulk else None
     DBSession.configure(bind=engine)
     Base.metadata.create_all(engine)
+    if args.create_indexes:
+        for name in create_indexes(engine):
+            log('Created index {}'.format(name))
 
     parser = OFXParser()
-    for filename in args.files:
-        log('Parsing "{}"...'.format(filename), end='')
-        parser.parse(filename)
-        log('done. Commiting to database...', end='')
-        parser.instantiate()
-        DBSession.commit()
-        log('done!')
+    loader = BulkLoader(on_conflict=args.upsert) if args.bulk_insert else None
+    records = 0
+    elapsed = 0.0
+    skipped = 0
+    try:
+        for filename in args.files:
+            digest = INGESTION.hash_file(filename)
+            if not args.force and INGESTION.is_ingested(digest):
+                log('Skipping "{}" (already ingested)'.format(filename))
+                skipped += 1
+                continue
+            log('Parsing "{}"...'.format(filename), end='')
+            parser.parse(filename)
+            log('done. Commiting to database...', end='')
+            start = time.time()
+            parser.instantiate(bulk=args.bulk, loader=loader)
+            if loader is not None:
+                loader.flush()
+            parser.ingestion(digest)
+            DBSession.commit()
+            elapsed += time.time() - start
+            # Count the rows handled by --bulk-insert, for comparison
+            records += sum(len(stmt.transactions) + len(getattr(stmt, 'positions', []))
+                           for stmt in parser.statements)
+            log('done!')
+    finally:
+        if profile is not None:
+            DBSession.remove()
+            profile.restore()
+
+    log('Loaded {} transactions/positions in {:.2f}s: {:.0f} rows/s '
+        '({} files skipped)'.format(
+            records, elapsed, records / max(elapsed, 1e-6), skipped))
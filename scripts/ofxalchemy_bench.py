@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Compare load times into SQLite with & without the bulk load connection
+profile (ofxtools.ofxalchemy.models.bulk_load_profile).
+
+Each run loads all the given files into a fresh database file, committing
+after each file as scripts/ofxalchemy.py does.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from ofxtools.ofxalchemy import Base, DBSession, OFXParser, BulkLoader
+from ofxtools.ofxalchemy.models import bulk_load_profile
+
+
+def log(message, end='\n'):
+    print(message, end=end)
+    sys.stdout.flush()
+
+
+def load(files, path, bulk_profile=False, bulk_insert=False):
+    """ Load files into a new SQLite DB at path; return elapsed seconds """
+    engine = create_engine('sqlite:///%s' % path)
+    profile = bulk_load_profile(engine) if bulk_profile else None
+    DBSession.remove()
+    DBSession.configure(bind=engine)
+    Base.metadata.create_all(engine)
+
+    loader = BulkLoader() if bulk_insert else None
+    start = time.time()
+    for filename in files:
+        parser = OFXParser()
+        parser.parse(filename)
+        parser.instantiate(bulk=True, loader=loader)
+        if loader is not None:
+            loader.flush()
+        DBSession.commit()
+    elapsed = time.time() - start
+
+    DBSession.remove()
+    if profile is not None:
+        profile.restore()
+    engine.dispose()
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--bulk-insert', action='store_true',
+                        help='Use the executemany bulk loader')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='Number of runs per profile; the best is shown')
+    parser.add_argument('--dir', default=None,
+                        help='Directory for the database files (default: '
+                             'system temp dir; use a real disk, not tmpfs)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        results = {}
+        for profile in ('default', 'bulk'):
+            timings = []
+            for n in range(args.repeat):
+                path = os.path.join(tmpdir, '%s%d.db' % (profile, n))
+                timings.append(load(args.files, path,
+                                    bulk_profile=(profile == 'bulk'),
+                                    bulk_insert=args.bulk_insert))
+            results[profile] = min(timings)
+            log('{:>8}: {:.3f}s'.format(profile, results[profile]))
+        log('Speedup: {:.2f}x'.format(
+            results['default'] / max(results['bulk'], 1e-6)))
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmark each stage of reading OFX, across a range of document sizes:
+
+    header       OFXHeader.strip()
+    feed         TreeBuilder.feed() & close()
+    convert      OFXTree.convert(), i.e. building the OFXResponse
+    instantiate  ofxalchemy OFXTree.instantiate()
+    commit       DBSession.commit() after a bulk instantiate(), including
+                 flushing the instances still pending.  Bulk instantiate()
+                 itself flushes before each batch of fingerprint lookups
+                 (which need their parents' ids), so most INSERTs happen in
+                 setup, not in the timed commit.
+
+Documents are made by ofxtools.synthetic.OFXGenerator.  Each stage is timed
+(best of --repeat runs), then run once more under tracemalloc (Python 3.4+)
+to record its peak memory (peak_bytes) and the number of memory blocks
+still allocated after it returns, net of those it freed (retained_blocks).
+The instantiate & commit stages need SQLAlchemy.  Stages and metrics that
+are unavailable under the running Python are reported, and recorded as
+null.
+
+Results are written as JSON, and may be compared against a saved baseline;
+the exit status is 1 if any stage regressed by more than --threshold, or if
+the baseline has results for a requested size & stage that this run lacks.
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+from ofxtools.header import OFXHeader
+from ofxtools.Parser import OFXTree, TreeBuilder, Element
+from ofxtools.synthetic import OFXGenerator
+
+try:
+    from sqlalchemy import create_engine
+    from ofxtools.ofxalchemy import Base, DBSession, OFXParser
+except ImportError:
+    # ofxalchemy stages need SQLAlchemy
+    OFXParser = None
+
+
+STAGE_NAMES = ('header', 'feed', 'convert', 'instantiate', 'commit')
+
+
+def log(message, end='\n'):
+    print(message, end=end)
+    sys.stdout.flush()
+
+
+class Stage(object):
+    """
+    One stage of the pipeline.  setup(path) prepares the input for the
+    stage (untimed) and returns the arguments for run(), which is timed;
+    teardown() cleans up after each run.
+    """
+    def __init__(self, name, setup, run, teardown=None):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.teardown = teardown or (lambda: None)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return (f.read(),)
+
+
+def _feed_setup(path):
+    source = _read(path)[0]
+    header, end = OFXHeader.parse(source)
+    return source[end:], header.codec
+
+
+def _feed(body, codec):
+    parser = TreeBuilder(element_factory=Element, encoding=codec)
+    parser.feed(body)
+    return parser.close()
+
+
+def _parse(path, Tree=OFXTree):
+    # Conversion consumes parts of the tree, so parse afresh for each run
+    tree = Tree()
+    tree.parse(path)
+    return tree
+
+
+class _Database(object):
+    """ Fresh SQLite DB file for each ofxalchemy run """
+    def __init__(self, tmpdir):
+        self.path = os.path.join(tmpdir, 'bench.db')
+        self.engine = None
+
+    def open(self):
+        self.close()
+        self.engine = create_engine('sqlite:///%s' % self.path)
+        DBSession.configure(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+
+    def close(self):
+        DBSession.remove()
+        if self.engine is not None:
+            self.engine.dispose()
+            self.engine = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def stages(tmpdir):
+    """ Return the list of Stages to benchmark """
+    result = [
+        Stage('header', _read, OFXHeader.strip),
+        Stage('feed', _feed_setup, _feed),
+        Stage('convert', lambda path: (_parse(path),),
+              lambda tree: tree.convert()),
+    ]
+    if OFXParser is not None:
+        db = _Database(tmpdir)
+
+        def instantiate_setup(path):
+            db.open()
+            return (_parse(path, OFXParser),)
+
+        def commit_setup(path):
+            tree, = instantiate_setup(path)
+            # N.B. this flushes all but the last batch of instances
+            tree.instantiate(bulk=True)
+            return ()
+
+        result.extend([
+            Stage('instantiate', instantiate_setup,
+                  lambda tree: tree.instantiate(), db.close),
+            Stage('commit', commit_setup, DBSession.commit, db.close),
+        ])
+    return result
+
+
+def measure(stage, path, repeat):
+    """ Return a dict of the stage's time, peak memory & retained blocks """
+    times = []
+    for n in range(repeat):
+        args = stage.setup(path)
+        gc.collect()
+        start = timeit.default_timer()
+        stage.run(*args)
+        times.append(timeit.default_timer() - start)
+        del args
+        stage.teardown()
+
+    peak = blocks = None
+    if tracemalloc is not None:
+        args = stage.setup(path)
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        result = stage.run(*args)
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        blocks = sum([stat.count_diff
+                      for stat in after.compare_to(before, 'filename')])
+        del args, result, before, after
+        stage.teardown()
+
+    return {'time': min(times), 'peak_bytes': peak,
+            'retained_blocks': blocks}
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results against baseline (both as written by main()).
+
+    Return (regressions, missing): a list of (key, metric, baseline value,
+    value) that grew by more than threshold (a fraction), and a list of
+    (key, metric) measured in the baseline, for a size & stage requested in
+    results, that results lack (metric is None if the whole key is missing).
+    """
+    regressions = []
+    missing = []
+    meta = results['meta']
+    for key, base in sorted(baseline['results'].items()):
+        metrics = results['results'].get(key)
+        if metrics is None:
+            size, stage = key.split('/')
+            if int(size) in meta['sizes'] and stage in meta['stages']:
+                missing.append((key, None))
+            continue
+        for metric in ('time', 'peak_bytes'):
+            old, new = base.get(metric), metrics.get(metric)
+            if old is None:
+                continue
+            if new is None:
+                missing.append((key, metric))
+            elif new > old * (1 + threshold):
+                regressions.append((key, metric, old, new))
+    return regressions, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--sizes', type=int, nargs='+',
+                        default=[100, 1000, 10000],
+                        help='Transactions per document')
+    parser.add_argument('--stages', nargs='+', default=list(STAGE_NAMES),
+                        choices=STAGE_NAMES, help='Only run these stages')
+    parser.add_argument('-k', '--acctkind', default='bank',
+                        choices=['bank', 'creditcard', 'investment'])
+    parser.add_argument('-v', '--version', type=int, default=102,
+                        help='OFX version of the documents')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='Timed runs per stage; the best is recorded')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Write results to this JSON file')
+    parser.add_argument('-b', '--baseline', default=None,
+                        help='Compare against this JSON results file')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='Allowed slowdown/growth vs. baseline, as a '
+                             'fraction (default: 0.1)')
+    parser.add_argument('--dir', default=None,
+                        help='Directory for temporary files')
+    args = parser.parse_args()
+
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': datetime.datetime.utcnow().isoformat(),
+            'acctkind': args.acctkind,
+            'version': args.version,
+            'repeat': args.repeat,
+            'sizes': args.sizes,
+            'stages': args.stages,
+        },
+        'results': {},
+    }
+
+    tmpdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        selected = [stage for stage in stages(tmpdir)
+                    if stage.name in args.stages]
+        unavailable = [name for name in args.stages
+                       if name not in [stage.name for stage in selected]]
+        if unavailable:
+            log('Skipping stages {} (SQLAlchemy not installed)'.format(
+                ', '.join(unavailable)))
+        if tracemalloc is None:
+            log('Not measuring peak_bytes & retained_blocks (tracemalloc '
+                'needs Python 3.4+)')
+        log('{:>8} {:<12} {:>10} {:>12} {:>10}'.format(
+            'size', 'stage', 'time (s)', 'peak (KB)', 'retained'))
+        for size in args.sizes:
+            kwargs = {}
+            if args.acctkind == 'investment':
+                securities = max(10, size // 100)
+                kwargs = {'securities': securities,
+                          'positions': min(securities, 50)}
+            path = os.path.join(tmpdir, '%d.ofx' % size)
+            OFXGenerator(transactions=size, acctkind=args.acctkind,
+                         version=args.version, **kwargs).write(path)
+            for stage in selected:
+                metrics = measure(stage, path, args.repeat)
+                results['results']['%d/%s' % (size, stage.name)] = metrics
+                log('{:>8} {:<12} {:>10.4f} {:>12} {:>10}'.format(
+                    size, stage.name, metrics['time'],
+                    '-' if metrics['peak_bytes'] is None
+                    else metrics['peak_bytes'] // 1024,
+                    '-' if metrics['retained_blocks'] is None
+                    else metrics['retained_blocks']))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions, missing = compare(results, baseline, args.threshold)
+        for key, metric, old, new in regressions:
+            log('REGRESSION {} {}: {:.4g} -> {:.4g} ({:+.0%})'.format(
+                key, metric, old, new, new / old - 1))
+        for key, metric in missing:
+            if metric is None:
+                log('MISSING {}: in baseline, but not measured'.format(key))
+            else:
+                log('Not compared: {} {} (not measured)'.format(key, metric))
+        if regressions or [key for key, metric in missing if metric is None]:
+            return 1
+        log('No regressions vs. {} (threshold {:.0%})'.format(
+            args.baseline, args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
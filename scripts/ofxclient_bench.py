@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmark OFXClient.download() end to end against a local OFX stand-in
+server (ofxtools.server.OFXServer), at increasing levels of concurrency.
+
+For each concurrency level, the given number of statement requests are
+downloaded by ofxtools.Client.download_all() with that many workers;
+requests/sec and the p50/p99 latency of the successful requests are
+reported.
+"""
+
+from __future__ import print_function
+
+import argparse
+import math
+import sys
+import time
+
+from ofxtools.Client import OFXClient, BankAcct, ConnectionPool, download_all
+from ofxtools.server import OFXServer
+
+
+def log(message, end='\n'):
+    print(message, end=end)
+    sys.stdout.flush()
+
+
+def percentile(values, pct):
+    """ Return the pct-th percentile of values (nearest rank) """
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def run(url, requests, concurrency, per_host=None, pool=None, timeout=30):
+    """
+    Download requests statements from url with download_all(), using
+    concurrency workers and at most per_host (default: concurrency) requests
+    in flight; return (elapsed seconds, latencies of successful requests,
+    errors).
+    """
+    client = OFXClient(url, 'FAKE', '1', pool=pool)
+    acct = BankAcct('123456789', '111', 'checking')
+    jobs = [(client, client.statement_request('user', 'pass', [acct]))
+            for n in range(requests)]
+    latencies = []
+    errors = []
+
+    start = time.time()
+    for result in download_all(jobs, workers=concurrency,
+                               per_host=per_host or concurrency,
+                               timeout=timeout):
+        if result.error is None:
+            latencies.append(result.elapsed)
+        else:
+            errors.append(result.error)
+    return time.time() - start, latencies, errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--concurrency', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16],
+                        help='Numbers of download_all() workers')
+    parser.add_argument('--per-host', type=int, default=None,
+                        help='download_all() per_host limit (default: the '
+                             'number of workers)')
+    parser.add_argument('-r', '--requests', type=int, default=200,
+                        help='Requests per concurrency level')
+    parser.add_argument('-n', '--transactions', type=int, default=100,
+                        help='Transactions per statement')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Server latency per request (seconds)')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Fraction of requests answered with HTTP 500')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pool', action='store_true',
+                        help='Reuse connections with a ConnectionPool')
+    parser.add_argument('--url', default=None,
+                        help='Benchmark an already running server instead')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = OFXServer(transactions=args.transactions,
+                           latency=args.latency, error_rate=args.error_rate,
+                           seed=args.seed).start()
+        url = server.url
+
+    try:
+        log('{:>11} {:>10} {:>10} {:>10} {:>7}'.format(
+            'concurrency', 'req/s', 'p50 (ms)', 'p99 (ms)', 'errors'))
+        for concurrency in args.concurrency:
+            pool = ConnectionPool(maxsize=concurrency) if args.pool else None
+            try:
+                elapsed, latencies, errors = run(url, args.requests,
+                                                 concurrency,
+                                                 per_host=args.per_host,
+                                                 pool=pool)
+            finally:
+                if pool is not None:
+                    pool.close()
+            log('{:>11} {:>10.1f} {:>10.2f} {:>10.2f} {:>7}'.format(
+                concurrency, args.requests / max(elapsed, 1e-6),
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000, len(errors)))
+    finally:
+        if server is not None:
+            server.stop()
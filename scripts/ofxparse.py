@@ -4,7 +4,10 @@
 from __future__ import print_function
 
 import argparse
+import multiprocessing
+import os
 import sys
+import time
 
 from ofxtools.Parser import OFXTree
 
@@ -14,14 +17,70 @@ def log(message, end='\n'):
     sys.stdout.flush()
 
 
+def parse(filename):
+    """
+    Parse & convert one file.
+
+    Runs in a worker process when --jobs > 1, so return only picklable
+    values: (filename, size in bytes (0 if unreadable), elapsed seconds,
+    summary of the OFXResponse, error).
+    """
+    start = time.time()
+    size = 0
+    summary = error = None
+    try:
+        size = os.path.getsize(filename)
+        parser = OFXTree()
+        parser.parse(filename)
+        response = parser.convert()
+        summary = {
+            'response': repr(response),
+            'transactions': sum(len(stmt.transactions)
+                                for stmt in response.statements),
+        }
+    except Exception as err:
+        error = '%s: %s' % (err.__class__.__name__, err)
+    return filename, size, time.time() - start, summary, error
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('files', nargs='+')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of worker processes')
     args = parser.parse_args()
 
-    parser = OFXTree()
-    for filename in args.files:
-        log('Parsing "{}"...'.format(filename), end='')
-        parser.parse(filename)
-        parser.convert()
-        log('done!')
+    start = time.time()
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.imap_unordered(parse, args.files)
+    else:
+        pool = None
+        results = (parse(filename) for filename in args.files)
+
+    errors = transactions = size = 0
+    try:
+        for filename, filesize, elapsed, summary, error in results:
+            size += filesize
+            if error is None:
+                transactions += summary['transactions']
+                log('{} ({:.3f}s): {}'.format(filename, elapsed,
+                                              summary['response']))
+            else:
+                errors += 1
+                log('{} ({:.3f}s): FAILED {}'.format(filename, elapsed,
+                                                     error))
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        # Don't leave workers behind on an error or KeyboardInterrupt
+        if pool is not None:
+            pool.terminate()
+
+    elapsed = max(time.time() - start, 1e-6)
+    megabytes = size / 1e6
+    log('Parsed {} files ({} failed) in {:.2f}s: {:.1f} files/s, '
+        '{:.2f} MB/s, {:.0f} transactions/s'.format(
+            len(args.files), errors, elapsed, len(args.files) / elapsed,
+            megabytes / elapsed, transactions / elapsed))
@@ -3,17 +3,22 @@
 import os
 import sys
 import unittest
+from decimal import Decimal
+from io import BytesIO
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 
-from ofxtools.ofxalchemy import Base, DBSession, OFXParser
+from ofxtools import instrument
+from ofxtools.ofxalchemy import Base, DBSession, OFXParser, BulkLoader, models
+from ofxtools.synthetic import OFXGenerator
 
 
-def ofx_to_database(filename):
+def ofx_to_database(filename, bulk=False):
     parser = OFXParser()
     parser.parse(filename)
-    parser.instantiate()
+    parser.instantiate(bulk=bulk)
     DBSession.commit()
+    return parser
 
 
 class AlchemyTestCase(unittest.TestCase):
@@ -25,6 +30,7 @@ class AlchemyTestCase(unittest.TestCase):
         Base.metadata.create_all(engine)
 
     def tearDown(self):
+        DBSession.remove()
         try:
             os.unlink('test.db')
         except OSError:  # file not created by test -- probably an error
@@ -50,3 +56,219 @@ class AlchemyTestCase(unittest.TestCase):
         filename = 'tests/data/invstmtrs.ofx'
         ofx_to_database(filename)
         # TODO: test the created database
+
+    def test_bulk_instantiate(self):
+        for filename in ('tests/data/stmtrs.ofx', 'tests/data/invstmtrs.ofx'):
+            parser = ofx_to_database(filename, bulk=True)
+            expected = [len(stmt.transactions) for stmt in parser.statements]
+            # Reloading the same file finds the persisted instances
+            reloaded = ofx_to_database(filename, bulk=True)
+            for stmt, other in zip(parser.statements, reloaded.statements):
+                self.assertEqual(list(other.transactions),
+                                 list(stmt.transactions))
+            self.assertEqual(
+                [len(stmt.transactions) for stmt in reloaded.statements],
+                expected)
+        self.assertEqual(DBSession.query(models.STMTTRN).count(), 2)
+        self.assertEqual(DBSession.query(models.INVTRAN).count(), 1)
+        self.assertEqual(DBSession.query(models.SECINFO).count(), 3)
+
+        # Fingerprints are looked up in bulk, not with a query per record
+        data = BytesIO()
+        OFXGenerator(transactions=200).write(data)
+        # (loading, then reloading the persisted records)
+        for n in range(2):
+            self.assertLessEqual(self._count_selects(data.getvalue(), True),
+                                 10)
+        self.assertGreaterEqual(self._count_selects(data.getvalue(), False),
+                                200)
+
+    def _count_selects(self, data, bulk):
+        """ Load the OFX data; return the number of SELECTs executed """
+        selects = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('SELECT'):
+                selects.append(statement)
+
+        engine = DBSession.get_bind()
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            parser = OFXParser()
+            parser.parse(BytesIO(data))
+            parser.instantiate(bulk=bulk)
+            DBSession.commit()
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        return len(selects)
+
+    def test_bulk_loader(self):
+        loader = BulkLoader()
+        for filename in ('tests/data/stmtrs.ofx', 'tests/data/invstmtrs.ofx',
+                         'tests/data/stmtrs.ofx'):
+            parser = OFXParser()
+            parser.parse(filename)
+            parser.instantiate(loader=loader)
+            loader.flush()
+            DBSession.commit()
+        # Records already loaded are skipped
+        self.assertEqual(loader.records, 6)
+        self.assertEqual(DBSession.query(models.STMTTRN).count(), 2)
+        self.assertEqual(DBSession.query(models.INVBANKTRAN).count(), 1)
+        buystock = DBSession.query(models.BUYSTOCK).one()
+        self.assertEqual(buystock.fitid, '23321')
+        self.assertEqual(buystock.secinfo.uniqueid, '123456789')
+        self.assertEqual(buystock.acctfrom.acctid, '999988')
+        self.assertEqual(
+            sorted([pos.__class__.__name__
+                    for pos in DBSession.query(models.INVPOS)]),
+            ['POSOPT', 'POSSTOCK'])
+
+    def _upsert(self, filename, on_conflict, trnamt=None):
+        loader = BulkLoader(on_conflict=on_conflict)
+        parser = OFXParser()
+        parser.parse(filename)
+        if trnamt is not None:
+            for elem in parser.findall('.//TRNAMT'):
+                elem.text = trnamt
+        parser.instantiate(loader=loader)
+        loader.flush()
+        DBSession.commit()
+        return loader
+
+    def test_upsert(self):
+        for filename in ('tests/data/stmtrs.ofx', 'tests/data/invstmtrs.ofx'):
+            loader = self._upsert(filename, 'nothing')
+            self.assertGreater(loader.records, 0)
+            # Conflicting records aren't counted as loaded
+            loader = self._upsert(filename, 'nothing', trnamt='1.23')
+            self.assertEqual((loader.records, loader.rows), (0, 0))
+        self.assertEqual(DBSession.query(models.STMTTRN).count(), 2)
+        self.assertEqual(DBSession.query(models.INVBANKTRAN).count(), 1)
+        self.assertEqual(DBSession.query(models.INVTRAN).count(), 1)
+        self.assertEqual(DBSession.query(models.INVPOS).count(), 2)
+        self.assertNotIn(Decimal('1.23'), [tran.trnamt for tran
+                                           in DBSession.query(models.STMTTRN)])
+
+        for filename in ('tests/data/stmtrs.ofx', 'tests/data/invstmtrs.ofx'):
+            self._upsert(filename, 'update', trnamt='1.23')
+        DBSession.expire_all()
+        self.assertEqual(DBSession.query(models.STMTTRN).count(), 2)
+        self.assertEqual(DBSession.query(models.BUYSTOCK).count(), 1)
+        self.assertEqual(set([tran.trnamt for tran
+                              in DBSession.query(models.STMTTRN)]),
+                         set([Decimal('1.23')]))
+        self.assertEqual(DBSession.query(models.INVBANKTRAN).one().trnamt,
+                         Decimal('1.23'))
+
+    def test_upsert_subclass(self):
+        # Records sharing (account, FITID) with an existing INVTRAN of
+        # another type are skipped, not attached to the wrong parent row.
+        for trntype, on_conflict in (('BUYSTOCK', 'nothing'),
+                                     ('SELLSTOCK', 'nothing'),
+                                     ('SELLSTOCK', 'update')):
+            data = BytesIO()
+            OFXGenerator(acctkind='investment', transactions=10, securities=1,
+                         trntypes={trntype: 1}).write(data)
+            data.seek(0)
+            loader = self._upsert(data, on_conflict)
+        self.assertEqual(loader.records, 0)
+        DBSession.expire_all()
+        self.assertEqual(DBSession.query(models.BUYSTOCK).count(), 10)
+        self.assertEqual(DBSession.query(models.SELLSTOCK).count(), 0)
+        self.assertEqual(DBSession.query(models.INVTRAN).count(), 10)
+        self.assertEqual(
+            DBSession.query(models.INVTRAN).filter(
+                models.INVTRAN.subclass != 'buystock').count(), 0)
+        self.assertTrue(all([tran.units > 0 for tran
+                             in DBSession.query(models.BUYSTOCK)]))
+
+    def test_upsert_invalid(self):
+        with self.assertRaises(ValueError):
+            BulkLoader(on_conflict='replace')
+
+    def test_ingestion(self):
+        filename = 'tests/data/invstmtrs.ofx'
+        digest = models.INGESTION.hash_file(filename)
+        self.assertFalse(models.INGESTION.is_ingested(digest))
+        parser = ofx_to_database(filename)
+        parser.ingestion(digest)
+        DBSession.commit()
+        self.assertTrue(models.INGESTION.is_ingested(digest))
+        entry = DBSession.query(models.INGESTION).one()
+        self.assertEqual(entry.digest, digest)
+        self.assertEqual(entry.newfileuid, None)
+        self.assertEqual((entry.org, entry.fid), ('NCH', '1001'))
+        self.assertEqual(entry.acctfrom, parser.statements[0].account)
+        # Recording the same file again replaces the entry
+        parser.ingestion(digest)
+        DBSession.commit()
+        self.assertEqual(DBSession.query(models.INGESTION).count(), 1)
+
+    def test_create_indexes(self):
+        engine = DBSession.get_bind()
+        # create_all() in setUp() has already created them
+        self.assertEqual(models.create_indexes(engine), [])
+        engine.execute('DROP INDEX ix_stmttrn_acctfrom_dtposted')
+        engine.execute('DROP INDEX ix_buystock_secinfo_id')
+        self.assertEqual(sorted(models.create_indexes(engine)),
+                         ['ix_buystock_secinfo_id',
+                          'ix_stmttrn_acctfrom_dtposted'])
+        self.assertEqual(models.create_indexes(engine), [])
+
+    def test_bulk_load_profile(self):
+        engine = create_engine('sqlite:///test.db')
+
+        def pragmas():
+            connection = engine.connect()
+            try:
+                return [connection.execute('PRAGMA %s' % name).scalar()
+                        for name in ('journal_mode', 'synchronous',
+                                     'temp_store', 'foreign_keys')]
+            finally:
+                connection.close()
+
+        default = pragmas()
+        self.assertEqual(default, ['delete', 2, 0, 1])
+        try:
+            with models.bulk_load_profile(engine) as profile:
+                # WAL, NORMAL, MEMORY
+                self.assertEqual(pragmas(), ['wal', 1, 2, 1])
+                self.assertTrue(event.contains(engine, 'connect',
+                                               profile.listener))
+                listener = profile.listener
+            self.assertFalse(event.contains(engine, 'connect', listener))
+            self.assertEqual(pragmas(), default)
+        finally:
+            engine.dispose()
+
+    def test_identity_map(self):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = DBSession.get_bind()
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            parser = ofx_to_database('tests/data/invstmtrs.ofx')
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        # SECIDs in INVPOS/INVTRAN resolve to the SECLIST instances, with
+        # only a query per SECLIST member
+        selects = [stmt for stmt in statements if stmt.startswith('SELECT')
+                   and 'FROM secinfo' in stmt]
+        self.assertEqual(len(selects), len(parser.securities))
+        buystock = DBSession.query(models.BUYSTOCK).one()
+        self.assertIn(buystock.secinfo, parser.securities)
+
+    def test_instrument(self):
+        with instrument.collecting() as stats:
+            ofx_to_database('tests/data/invstmtrs.ofx')
+        self.assertIn('instantiate', stats.stages)
+        self.assertGreater(stats.counts['sql']['SELECT'], 0)
+        self.assertGreater(stats.counts['sql']['INSERT'], 0)
+        self.assertEqual(stats.queries, sum(stats.counts['sql'].values()))
+        # Listeners are removed when disabled
+        ofx_to_database('tests/data/stmtrs.ofx')
+        self.assertEqual(stats.queries, sum(stats.counts['sql'].values()))
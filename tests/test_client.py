@@ -0,0 +1,404 @@
+# coding: utf-8
+
+import datetime
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+import xml.etree.ElementTree as ET
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import ofxtools
+from ofxtools.Client import (
+    OFXClient,
+    BankAcct,
+    ConnectionPool,
+    HTTPError,
+    download_all,
+    CcAcct,
+    InvAcct,
+)
+from ofxtools.server import OFXServer
+
+
+class FakeClient(OFXClient):
+    """ OFXClient whose _download() just sleeps & tracks concurrency """
+    def __init__(self, url, delay=0.05, fail=False):
+        OFXClient.__init__(self, url, org='FAKE', fid='1')
+        self.delay = delay
+        self.fail = fail
+        self.active = 0
+        self.peak = 0
+        self.timeouts = []
+        self.lock = threading.Lock()
+
+    def _download(self, request, timeout=None):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.timeouts.append(timeout)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if self.fail:
+            raise IOError('Connection refused')
+        return ET.tostring(request)
+
+
+class DownloadAllTestCase(unittest.TestCase):
+    def setUp(self):
+        self.acct = BankAcct('123456789', '111', 'checking')
+
+    def jobs(self, client, n):
+        return [(client, client.statement_request('user', 'pass', [self.acct]))
+                for i in range(n)]
+
+    def test_per_host(self):
+        slow = FakeClient('https://slow.example.com/ofx', delay=0.1)
+        fast = FakeClient('https://fast.example.com/ofx', delay=0.01)
+        jobs = self.jobs(slow, 6) + self.jobs(fast, 6)
+        results = list(download_all(jobs, workers=8, per_host=2, timeout=5))
+        self.assertEqual(len(results), 12)
+        self.assertLessEqual(slow.peak, 2)
+        self.assertLessEqual(fast.peak, 2)
+        self.assertEqual(set(slow.timeouts + fast.timeouts), set([5]))
+        # Results are yielded as they complete
+        clients = [result.client for result in results]
+        self.assertIs(clients[0], fast)
+        self.assertIs(clients[-1], slow)
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertEqual(result.response, ET.tostring(result.request))
+        # Jobs sharing a client don't overwrite each other's response
+        self.assertFalse(hasattr(slow, 'response'))
+
+    def test_errors(self):
+        good = FakeClient('https://good.example.com/ofx', delay=0)
+        bad = FakeClient('https://bad.example.com/ofx', delay=0, fail=True)
+        results = list(download_all(self.jobs(good, 2) + self.jobs(bad, 2)))
+        errors = [result for result in results if result.error is not None]
+        self.assertEqual(len(errors), 2)
+        for result in errors:
+            self.assertIs(result.client, bad)
+            self.assertIsNone(result.response)
+            self.assertIsInstance(result.error, IOError)
+
+    def test_elapsed(self):
+        # Time spent waiting for the per_host limit isn't counted
+        client = FakeClient('https://slow.example.com/ofx', delay=0.1)
+        results = list(download_all(self.jobs(client, 4), workers=4,
+                                    per_host=1))
+        self.assertEqual(client.peak, 1)
+        for result in results:
+            self.assertLess(result.elapsed, 0.2)
+
+    def test_empty(self):
+        self.assertEqual(list(download_all([])), [])
+
+
+class OFXHandler(BaseHTTPRequestHandler):
+    """ Answer any POST with tests/data/invstmtrs.ofx """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.server.requests.append(
+            self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.clients.append(self.client_address)
+        self.server.paths.append(self.path)
+        with open('tests/data/invstmtrs.ofx', 'rb') as f:
+            body = f.read()
+        if self.path == '/error':
+            self.send_error(500)
+            return
+        if self.path == '/bare':
+            # Status line with no headers; the body runs to EOF
+            self.wfile.write(b'HTTP/1.0 200 OK\r\n\r\n' + body)
+            self.close_connection = True
+            return
+        if self.path == '/noreason':
+            # Status line without a reason phrase
+            self.wfile.write(('HTTP/1.1 200\r\nContent-Length: %d\r\n\r\n'
+                              % len(body)).encode('ascii') + body)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ofx')
+        if self.path == '/chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(body), 100):
+                chunk = body[start:start+100]
+                self.wfile.write(('%x\r\n' % len(chunk)).encode('ascii'))
+                self.wfile.write(chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+    """ Runs OFXHandler on localhost """
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), OFXHandler)
+        self.server.requests = []
+        self.server.clients = []
+        self.server.paths = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.acct = BankAcct('123456789', '111', 'checking')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d%s' % (self.server.server_port, path)
+
+
+@unittest.skipIf(sys.version_info < (3, 6), 'AsyncOFXClient requires Python 3.6')
+class AsyncClientTestCase(ServerTestCase):
+    def run_client(self, path, method):
+        import asyncio
+        client = ofxtools.AsyncOFXClient(self.url(path), 'FAKE', '1')
+        request = client.statement_request('user', 'pass', [self.acct])
+        result = asyncio.run(getattr(client, method)(request, timeout=5))
+        self.assertIn(b'<STMTRQ>', self.server.requests[0])
+        return result
+
+    def test_download(self):
+        with open('tests/data/invstmtrs.ofx', 'rb') as f:
+            expected = f.read()
+        for path in ('/', '/chunked', '/bare', '/noreason'):
+            self.assertEqual(self.run_client(path, 'download').read(),
+                             expected)
+
+    def test_query(self):
+        self.run_client('/ofx?user=1&mode=ofx', 'download')
+        self.assertEqual(self.server.paths, ['/ofx?user=1&mode=ofx'])
+
+    def test_download_and_parse(self):
+        for path in ('/', '/chunked'):
+            tree = self.run_client(path, 'download_and_parse')
+            self.assertEqual(tree.header.version, 200)
+            response = tree.convert()
+            self.assertEqual(len(response.statements), 1)
+            self.assertEqual(len(response.securities), 3)
+
+    def test_http_error(self):
+        from urllib.error import HTTPError
+        with self.assertRaises(HTTPError):
+            self.run_client('/error', 'download')
+
+
+class ConnectionPoolTestCase(ServerTestCase):
+    def download(self, pool, path='/', n=3):
+        client = OFXClient(self.url(path), 'FAKE', '1', pool=pool)
+        request = client.statement_request('user', 'pass', [self.acct])
+        with open('tests/data/invstmtrs.ofx', 'rb') as f:
+            expected = f.read()
+        try:
+            for i in range(n):
+                self.assertEqual(client.download(request, timeout=5).read(),
+                                 expected)
+        finally:
+            pool.close()
+
+    def test_reuse(self):
+        self.download(ConnectionPool())
+        self.assertEqual(len(self.server.requests), 3)
+        # All requests were made over the same connection
+        self.assertEqual(len(set(self.server.clients)), 1)
+
+    def test_idle_timeout(self):
+        self.download(ConnectionPool(idle_timeout=-1))
+        self.assertEqual(len(set(self.server.clients)), 3)
+
+    def test_server_closed(self):
+        pool = ConnectionPool()
+        self.download(pool, n=1)
+        # Stale connection in the pool; the request is retried on a new one
+        stale = _ClosedConnection()
+        pool._checkin(('http', '127.0.0.1:%d' % self.server.server_port),
+                      stale)
+        self.download(pool, n=1)
+        self.assertTrue(stale.closed)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_sent_not_retried(self):
+        pool = ConnectionPool()
+        server = ('http', '127.0.0.1:%d' % self.server.server_port)
+        # The request was sent, but the response failed; don't resend it
+        stale = _ClosedConnection(sent=True)
+        pool._checkin(server, stale)
+        with self.assertRaises(socket.error):
+            self.download(pool, n=1)
+        self.assertTrue(stale.closed)
+        self.assertEqual(stale.requests, 1)
+        self.assertEqual(len(self.server.requests), 0)
+
+    def test_dropped(self):
+        pool = ConnectionPool()
+        server = ('http', '127.0.0.1:%d' % self.server.server_port)
+        # An idle connection the server has closed isn't used at all
+        stale = _ClosedConnection()
+        stale.sock, peer = socket.socketpair()
+        peer.close()
+        pool._checkin(server, stale)
+        self.download(pool, n=1)
+        self.assertTrue(stale.closed)
+        self.assertEqual(stale.requests, 0)
+        stale.sock.close()
+
+    def test_timeout_reset(self):
+        pool = ConnectionPool()
+        client = OFXClient(self.url('/'), 'FAKE', '1', pool=pool)
+        request = client.statement_request('user', 'pass', [self.acct])
+        server = ('http', '127.0.0.1:%d' % self.server.server_port)
+        try:
+            client.download(request, timeout=5)
+            connection = pool._checkout(server)
+            self.assertEqual(connection.sock.gettimeout(),
+                             socket.getdefaulttimeout())
+            pool._checkin(server, connection)
+            client.download(request, timeout=3)
+            self.assertEqual(pool._idle[server][0][0].sock.gettimeout(), 3)
+        finally:
+            pool.close()
+
+    def test_http_error(self):
+        pool = ConnectionPool()
+        with self.assertRaises(HTTPError):
+            self.download(pool, path='/error', n=1)
+
+
+class _ClosedConnection(object):
+    """
+    Stands in for a keep-alive connection closed by the server, which fails
+    to send the request, or (if sent) to read the response
+    """
+    sock = None
+    closed = False
+
+    def __init__(self, sent=False):
+        self.sent = sent
+        self.requests = 0
+
+    def request(self, *args, **kwargs):
+        self.requests += 1
+        if not self.sent:
+            raise socket.error('Connection reset by peer')
+
+    def getresponse(self):
+        raise socket.error('Connection reset by peer')
+
+    def close(self):
+        self.closed = True
+
+
+class DownloadAndParseTestCase(ServerTestCase):
+    def download_and_parse(self, path='/', pool=None, **kwargs):
+        client = OFXClient(self.url(path), 'FAKE', '1', pool=pool)
+        request = client.statement_request('user', 'pass', [self.acct])
+        return client, client.download_and_parse(request, timeout=5, **kwargs)
+
+    def test_download_and_parse(self):
+        pool = ConnectionPool()
+        try:
+            for path, pool in (('/', None), ('/chunked', None), ('/', pool)):
+                client, tree = self.download_and_parse(path, pool)
+                self.assertEqual(tree.header.version, 200)
+                self.assertEqual(tree.find('.//FITID').text, '23321')
+                # Raw response is discarded by default
+                self.assertIsNone(getattr(client, 'response', None))
+        finally:
+            pool.close()
+
+    def test_convert(self):
+        client, response = self.download_and_parse(convert=True)
+        self.assertEqual(len(response.statements), 1)
+        self.assertEqual(len(response.securities), 3)
+
+    def test_keep_raw(self):
+        with open('tests/data/invstmtrs.ofx', 'rb') as f:
+            expected = f.read()
+        client, tree = self.download_and_parse(keep_raw=True)
+        self.assertEqual(client.response.read(), expected)
+
+    def test_http_error(self):
+        with self.assertRaises(HTTPError):
+            self.download_and_parse('/error')
+
+
+class OFXServerTestCase(unittest.TestCase):
+    """ Runs the stand-in ofxtools.server.OFXServer on localhost """
+    accounts = [BankAcct('123456789', '111', 'checking'), CcAcct('222'),
+                InvAcct('broker.example.com', '333')]
+
+    def download_and_parse(self, server, request=None, **kwargs):
+        client = OFXClient(server.url, 'FAKE', '1')
+        if request is None:
+            request = client.statement_request('user', 'pass', self.accounts)
+        return client.download_and_parse(request, timeout=5, **kwargs)
+
+    def test_statements(self):
+        with OFXServer(transactions=25, seed=1) as server:
+            response = self.download_and_parse(server, convert=True)
+            again = self.download_and_parse(server, convert=True)
+        self.assertEqual([stmt.__class__.__name__
+                          for stmt in response.statements],
+                         ['BankStatement', 'CreditCardStatement',
+                          'InvestmentStatement'])
+        for stmt, acct in zip(response.statements, self.accounts):
+            self.assertEqual(len(stmt.transactions), 25)
+            self.assertEqual(stmt.account.acctid, acct._acct['ACCTID'])
+        # Statements are reproducible
+        self.assertEqual(
+            [tx.trnamt for tx in response.statements[0].transactions],
+            [tx.trnamt for tx in again.statements[0].transactions])
+        self.assertEqual(server.requests, 2)
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), 'Needs time.tzset()')
+    def test_dtserver(self):
+        # DTSERVER is the current time in GMT, whatever the local timezone
+        tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'EST+05'
+        time.tzset()
+        try:
+            with OFXServer(transactions=1) as server:
+                response = self.download_and_parse(server, convert=True)
+        finally:
+            if tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = tz
+            time.tzset()
+        skew = response.sonrs.dtserver - datetime.datetime.utcnow()
+        self.assertLess(abs(skew), datetime.timedelta(minutes=1))
+
+    def test_profile(self):
+        with OFXServer() as server:
+            client = OFXClient(server.url, 'FAKE', '1')
+            tree = self.download_and_parse(server, client.profile_request())
+        self.assertIsNotNone(tree.find('.//PROFRS/DTPROFUP'))
+
+    def test_error_rate(self):
+        with OFXServer(error_rate=1) as server:
+            with self.assertRaises(HTTPError):
+                self.download_and_parse(server)
+        self.assertEqual((server.requests, server.errors), (1, 1))
+
+    def test_latency(self):
+        with OFXServer(transactions=1, latency=0.2) as server:
+            start = time.time()
+            self.download_and_parse(server)
+        self.assertGreaterEqual(time.time() - start, 0.2)
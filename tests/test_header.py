@@ -1,6 +1,7 @@
 # vim: set fileencoding=utf-8
 
 # stdlib imports
+import sys
 import unittest
 
 
@@ -41,6 +42,8 @@ class HeaderV1TestCase(unittest.TestCase):
     OLDFILEUID:NONE
     NEWFILEUID:NONE
     """.strip()
+    version = 102
+    codec = 'cp1252'
 
     @property
     def ofx(self):
@@ -50,9 +53,24 @@ class HeaderV1TestCase(unittest.TestCase):
         body = ofxtools.header.OFXHeader.strip(self.ofx)
         self.assertEqual(body, sgml)
 
+    def test_parse_bytes(self):
+        ofx = self.ofx.encode('ascii')
+        sources = [ofx]
+        # Python 2 regexes don't accept memoryview
+        if sys.version_info.major == 3:
+            sources.append(memoryview(ofx))
+        for source in sources:
+            header, end = ofxtools.header.OFXHeader.parse(source)
+            self.assertEqual(bytes(source[end:]), sgml.encode('ascii'))
+            self.assertEqual(header.version, self.version)
+            self.assertEqual(header.newfileuid, 'NONE')
+            self.assertEqual(header.codec, self.codec)
+
 
 class HeaderV2TestCase(HeaderV1TestCase):
     header = """
     <?xml version="1.0" encoding="UTF-8" standalone="no"?>
     <?OFX OFXHEADER="200" VERSION="200" SECURITY="NONE" OLDFILEUID="NONE" NEWFILEUID="NONE"?>
     """.strip()
+    version = 200
+    codec = 'UTF-8'
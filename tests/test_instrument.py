@@ -0,0 +1,86 @@
+# vim: set fileencoding=utf-8
+
+# stdlib imports
+import unittest
+
+
+# local imports
+from ofxtools import instrument
+from ofxtools.Parser import OFXTree, TreeBuilder, InstrumentedTreeBuilder
+
+
+class InstrumentTestCase(unittest.TestCase):
+    def tearDown(self):
+        instrument.disable()
+
+    def parse(self):
+        tree = OFXTree()
+        tree.parse('tests/data/stmtrs.ofx')
+        tree.convert()
+        return tree
+
+    def test_collecting(self):
+        with instrument.collecting() as stats:
+            self.parse()
+        self.assertFalse(instrument.enabled())
+        self.assertEqual(set(stats.stages),
+                         set(['header', 'tokenize', 'build', 'convert']))
+        for seconds in stats.stages.values():
+            self.assertGreaterEqual(seconds, 0)
+        self.assertEqual(stats.tags['STMTTRN'], 2)
+        self.assertEqual(stats.tags['STATUS'], 2)
+        # DTSERVER/DTPROFUP/DTACCTUP/DTPOSTED x2/DTUSER/DTASOF x2, plus
+        # unset DateTime elements of SONRS/STMTTRN/LEDGERBAL/AVAILBAL
+        self.assertGreater(stats.counts['convert']['DateTime'], 8)
+        self.assertIn('Decimal', stats.times['convert'])
+        self.assertIn('STMTTRN', stats.report())
+
+    def test_callback(self):
+        events = []
+        instrument.enable(lambda *event: events.append(event))
+        self.parse()
+        instrument.disable()
+        kinds = set([kind for kind, name, value in events])
+        self.assertEqual(kinds, set(['stage', 'tag', 'convert']))
+        self.assertIn(('tag', 'STMTTRN', 2), events)
+
+    def test_disabled(self):
+        events = []
+        instrument.enable(lambda *event: events.append(event))
+        instrument.disable()
+        self.parse()
+        self.assertEqual(events, [])
+        self.assertIs(instrument.stage('header'), instrument.stage('build'))
+
+    def test_treebuilder(self):
+        tree = OFXTree()
+        self.assertIs(type(tree._treebuilder()), TreeBuilder)
+        instrument.enable()
+        self.assertIs(type(tree._treebuilder()), InstrumentedTreeBuilder)
+
+    def test_feed(self):
+        with open('tests/data/stmtrs.ofx', 'rb') as f:
+            data = f.read()
+        with instrument.collecting() as stats:
+            tree = OFXTree()
+            for start in range(0, len(data), 100):
+                tree.feed(data[start:start+100])
+            tree.close()
+        self.assertEqual(stats.tags['STMTTRN'], 2)
+        self.assertIn('tokenize', stats.stages)
+
+    def test_register(self):
+        calls = []
+        instrument.register(lambda: calls.append('install'),
+                            lambda: calls.append('uninstall'))
+        try:
+            with instrument.collecting():
+                # Re-enabling doesn't reinstall hooks
+                instrument.enable()
+            self.assertEqual(calls, ['install', 'uninstall'])
+        finally:
+            del instrument._hooks[-1]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 # coding: utf-8
 
+import pickle
 import unittest
+import weakref
 from datetime import datetime
 from decimal import Decimal
 import xml.etree.ElementTree as ET
@@ -536,3 +538,96 @@ class ModelTestCase(unittest.TestCase):
         self.assertEqual(optinfo.shperctrct, 100)
         self.assertEqual(optinfo.assetclass, 'LARGESTOCK')
 
+
+    def test_elements(self):
+        # Element registry is computed once per class, following the MRO
+        from ofxtools.models import INVBUY, SECINFO, BUYSTOCK
+        self.assertIs(BUYSTOCK.elements['unitprice'],
+                      INVBUY.__dict__['unitprice'])
+        self.assertIs(SECINFO.elements['unitprice'],
+                      SECINFO.__dict__['unitprice'])
+        self.assertIn('buytype', BUYSTOCK._required)
+        self.assertIn('fitid', BUYSTOCK._required)
+        self.assertNotIn('markup', BUYSTOCK._required)
+        self.assertEqual(Aggregate.elements, {})
+
+    def test_slots(self):
+        # Element values are stored in slots, not in the instance __dict__
+        buystock = Aggregate.from_etree(deepcopy(invtranlist[2]))
+        self.assertIsInstance(buystock, ofxtools.models.BUYSTOCK)
+        self.assertEqual(type(buystock).__name__, 'BUYSTOCK')
+        self.assertEqual(buystock.__dict__, {})
+        self.assertEqual(buystock.units, Decimal('100'))
+
+        # Setting Element values performs validation & type conversion
+        buystock.units = '200'
+        self.assertEqual(buystock.units, Decimal('200'))
+        with self.assertRaises(ValueError):
+            buystock.buytype = 'SELL'
+
+    def test_weakref_pickle(self):
+        # The hidden storage subclass supports weak references & pickling
+        buystock = Aggregate.from_etree(deepcopy(invtranlist[2]))
+        buystock.extra = 'extra'
+        self.assertIs(weakref.ref(buystock)(), buystock)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            clone = pickle.loads(pickle.dumps(buystock, protocol))
+            self.assertIs(type(clone), type(buystock))
+            self.assertEqual(repr(clone), repr(buystock))
+            self.assertEqual(clone.extra, 'extra')
+        clone = deepcopy(buystock)
+        self.assertEqual(clone.dttrade, buystock.dttrade)
+
+    def test_compiled_converter(self):
+        # The converter generated for each Aggregate class gives the same
+        # results & errors as calling each Element's convert() in turn
+        from ofxtools.models import STMTTRN, STATUS
+
+        def generic(SubClass, attributes):
+            instance = object.__new__(SubClass._storage)
+            for name, convert, setslot in SubClass._storage._converters:
+                setslot(instance, convert(attributes.pop(name, None)))
+            return instance
+
+        def compiled(SubClass, attributes):
+            instance = object.__new__(SubClass._storage)
+            SubClass._storage._convert(instance, attributes)
+            return instance
+
+        stmttrn = {'trntype': 'CHECK', 'dtposted': '20051004',
+                   'trnamt': '-200.00', 'fitid': '00002', 'checknum': '1000',
+                   'sic': '5411', 'currate': '1,5', 'memo': ''}
+        expected = generic(STMTTRN, dict(stmttrn))
+        instance = compiled(STMTTRN, dict(stmttrn))
+        for name in STMTTRN.elements:
+            self.assertEqual(getattr(instance, name),
+                             getattr(expected, name))
+        self.assertEqual(instance.currate, Decimal('1.5'))
+        self.assertIsNone(instance.memo)
+
+        for SubClass, attributes in (
+            (STMTTRN, dict(stmttrn, trntype='BOGUS')),
+            (STMTTRN, dict(stmttrn, trnamt='abc')),
+            (STMTTRN, dict(stmttrn, sic='5411a')),
+            (STMTTRN, dict(stmttrn, checknum='1' * 13)),
+            (STMTTRN, dict(stmttrn, fitid='')),
+            (STMTTRN, dict(stmttrn, trntype=None)),
+            (STATUS, {'code': '1234567', 'severity': 'INFO'}),
+        ):
+            with self.assertRaises(ValueError):
+                generic(SubClass, dict(attributes))
+            with self.assertRaises(ValueError):
+                compiled(SubClass, dict(attributes))
+
+        # Every Aggregate in a parsed statement converts as before
+        for elem in ofx.iter():
+            SubClass = getattr(ofxtools.models, elem.tag, None)
+            if not (isinstance(SubClass, type)
+                    and issubclass(SubClass, Aggregate)):
+                continue
+            attributes = deepcopy(elem)._flatten()
+            expected = generic(SubClass, dict(attributes))
+            instance = compiled(SubClass, dict(attributes))
+            for name in SubClass.elements:
+                self.assertEqual(getattr(instance, name),
+                                 getattr(expected, name))
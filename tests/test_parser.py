@@ -1,9 +1,14 @@
 # coding: utf-8
 
+import os
+import sys
+import tempfile
 import unittest
+import xml.etree.ElementTree as ET
 
 import ofxtools
 from ofxtools.Parser import OFXTree
+from ofxtools.header import OFXHeaderError
 
 
 def ofx_parse(filename):
@@ -278,3 +283,195 @@ class TreeBuilderTestCase(unittest.TestCase):
         self.assertEqual(availbal, {'balamt': '200.29',
                                     'dtasof': '200510291120'})
 
+
+
+class IterparseTestCase(unittest.TestCase):
+    def test_iterparse(self):
+        tree = OFXTree()
+        tags = [elem.tag for elem in tree.iterparse('tests/data/invstmtrs.ofx')]
+        self.assertEqual(tags, ['BUYSTOCK', 'INVBANKTRAN', 'POSSTOCK',
+                                'POSOPT', 'STOCKINFO', 'STOCKINFO',
+                                'OPTINFO'])
+
+        # Yielded subtrees have been pruned from the parse tree
+        self.assertEqual(len(tree.find('.//INVTRANLIST')), 2)
+        self.assertEqual(len(tree.find('.//INVPOSLIST')), 0)
+        self.assertEqual(len(tree.find('.//SECLIST')), 0)
+        self.assertIsNotNone(tree.find('SIGNONMSGSRSV1/SONRS'))
+
+    def test_convert_stream(self):
+        tree = OFXTree()
+        trans = [ofxtools.models.Aggregate.from_etree(elem)
+                 for elem in tree.iterparse('tests/data/stmtrs.ofx')]
+        self.assertEqual(len(trans), 2)
+        self.assertIsInstance(trans[0], ofxtools.models.STMTTRN)
+        self.assertEqual(trans[1].fitid, '00003')
+
+
+class ChunkedFeedTestCase(unittest.TestCase):
+    def test_feed_chunks(self):
+        """ Tags split across chunk boundaries parse the same as whole """
+        for chunksize in (1, 7, 64):
+            parser = ofxtools.Parser.TreeBuilder(
+                element_factory=ofxtools.Parser.Element)
+            for i in range(0, len(sgml), chunksize):
+                parser.feed(sgml[i:i+chunksize])
+            root = parser.close()
+            self.assertEqual(ET.tostring(root), ET.tostring(ofx))
+
+    def test_iterparse_chunks(self):
+        tree = OFXTree()
+        tags = [elem.tag for elem in
+                tree.iterparse('tests/data/invstmtrs.ofx', chunksize=300)]
+        self.assertEqual(len(tags), 7)
+        self.assertEqual(tree.find('.//SONRS/FI/ORG').text, 'NCH')
+
+
+class BytesFeedTestCase(unittest.TestCase):
+    def test_feed_bytes(self):
+        """ Bytes parse the same as str """
+        parser = ofxtools.Parser.TreeBuilder(
+            element_factory=ofxtools.Parser.Element)
+        parser.feed(sgml.encode('ascii'))
+        root = parser.close()
+        self.assertEqual(ET.tostring(root), ET.tostring(ofx))
+
+    @unittest.skipIf(sys.version_info.major < 3,
+                     'Python 2 leaves element text as bytes')
+    def test_decode_text(self):
+        parser = ofxtools.Parser.TreeBuilder(
+            element_factory=ofxtools.Parser.Element, encoding='cp1252')
+        parser.feed(b'<MEMO>Caf\xe9</MEMO>')
+        self.assertEqual(parser.close().text, u'Caf\xe9')
+
+    def test_parse_header_codec(self):
+        tree = OFXTree()
+        tree.parse('tests/data/stmtrs.ofx')
+        self.assertEqual(tree.header.codec, 'UTF-8')
+
+
+class MmapTestCase(unittest.TestCase):
+    def test_parse_mmap(self):
+        for filename in ('tests/data/stmtrs.ofx', 'tests/data/invstmtrs.ofx'):
+            tree = OFXTree()
+            tree.parse(filename)
+            mapped = OFXTree()
+            mapped.parse(filename, use_mmap=True)
+            self.assertEqual(ET.tostring(mapped.getroot()),
+                             ET.tostring(tree.getroot()))
+            mapped.convert()
+
+    def test_parse_mmap_close(self):
+        closed = []
+
+        class Tree(OFXTree):
+            @staticmethod
+            def _mmap(source):
+                mapped = OFXTree._mmap(source)
+                closed.append(mapped)
+                return mapped
+
+        Tree().parse('tests/data/stmtrs.ofx', use_mmap=True)
+        with self.assertRaises(ValueError):
+            closed[0][:1]
+
+    def test_parse_mmap_empty(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            for use_mmap in (False, True):
+                with self.assertRaises(OFXHeaderError):
+                    OFXTree().parse(filename, use_mmap=use_mmap)
+        finally:
+            os.remove(filename)
+
+
+class ResponseTestCase(unittest.TestCase):
+    def test_statement_order(self):
+        tree = OFXTree()
+        tree.parse('tests/data/stmtrs.ofx')
+        root = tree.getroot()
+        # Put a credit card statement ahead of the bank statement
+        other = OFXTree()
+        other.parse('tests/data/stmtrs.ofx')
+        ccstmttrnrs = other.find('BANKMSGSRSV1/STMTTRNRS')
+        ccstmttrnrs.tag = 'CCSTMTTRNRS'
+        stmtrs = ccstmttrnrs.find('STMTRS')
+        stmtrs.tag = 'CCSTMTRS'
+        stmtrs.remove(stmtrs.find('BANKACCTFROM'))
+        acct = ofxtools.Parser.Element('CCACCTFROM')
+        acctid = ofxtools.Parser.Element('ACCTID')
+        acctid.text = '4321'
+        acct.append(acctid)
+        stmtrs.append(acct)
+        msgs = ofxtools.Parser.Element('CREDITCARDMSGSRSV1')
+        msgs.append(ccstmttrnrs)
+        root.insert(1, msgs)
+
+        response = tree.convert()
+        self.assertEqual([type(stmt) for stmt in response.statements],
+                         [ofxtools.Response.CreditCardStatement,
+                          ofxtools.Response.BankStatement])
+        ccstmt, stmt = response.statements
+        self.assertEqual(ccstmt.account.acctid, '4321')
+        self.assertEqual(ccstmt.uid, stmt.uid)
+        self.assertEqual(len(ccstmt.transactions), len(stmt.transactions))
+
+    def test_missing_account(self):
+        tree = OFXTree()
+        tree.parse('tests/data/stmtrs.ofx')
+        stmtrs = tree.find('BANKMSGSRSV1/STMTTRNRS/STMTRS')
+        stmtrs.remove(stmtrs.find('BANKACCTFROM'))
+        with self.assertRaises(ValueError):
+            tree.convert()
+
+    def test_missing_required(self):
+        for filename, path, tag in (
+            ('tests/data/stmtrs.ofx', 'BANKMSGSRSV1/STMTTRNRS/STMTRS',
+             'LEDGERBAL'),
+            ('tests/data/stmtrs.ofx', 'BANKMSGSRSV1/STMTTRNRS', 'TRNUID'),
+            ('tests/data/stmtrs.ofx', 'BANKMSGSRSV1/STMTTRNRS', 'STATUS'),
+            ('tests/data/invstmtrs.ofx', 'INVSTMTMSGSRSV1/INVSTMTTRNRS/'
+             'INVSTMTRS', 'DTASOF'),
+        ):
+            tree = OFXTree()
+            tree.parse(filename)
+            parent = tree.find(path)
+            parent.remove(parent.find(tag))
+            with self.assertRaises(ValueError) as context:
+                tree.convert()
+            self.assertIn('<%s>' % tag, str(context.exception))
+
+
+class FeedTestCase(unittest.TestCase):
+    def test_feed(self):
+        for filename in ('tests/data/stmtrs.ofx', 'tests/data/invstmtrs.ofx'):
+            tree = OFXTree()
+            tree.parse(filename)
+            with open(filename, 'rb') as f:
+                data = f.read()
+            # Small chunks split the OFX header as well as the body
+            fed = OFXTree()
+            for start in range(0, len(data), 7):
+                fed.feed(data[start:start+7])
+            root = fed.close()
+            self.assertIs(root, fed.getroot())
+            self.assertEqual(fed.header.version, tree.header.version)
+            self.assertEqual(ET.tostring(root), ET.tostring(tree.getroot()))
+            fed.convert()
+
+    def test_feed_bad_header(self):
+        tree = OFXTree()
+        with self.assertRaises(ofxtools.header.OFXHeaderError):
+            tree.feed(b'<?xml version="1.0"?><OFX>')
+        tree = OFXTree()
+        with self.assertRaises(ofxtools.header.OFXHeaderError):
+            tree.feed(b' ' * (OFXTree.max_header_size + 1))
+
+    def test_close_without_body(self):
+        with open('tests/data/stmtrs.ofx', 'rb') as f:
+            data = f.read()
+        tree = OFXTree()
+        tree.feed(data[:data.index(b'<OFX>')])
+        with self.assertRaises(ofxtools.header.OFXHeaderError):
+            tree.close()
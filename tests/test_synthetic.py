@@ -0,0 +1,102 @@
+# vim: set fileencoding=utf-8
+
+# stdlib imports
+import unittest
+from collections import Counter
+from io import BytesIO
+
+
+# local imports
+from ofxtools.Parser import OFXTree
+from ofxtools.synthetic import OFXGenerator
+
+
+def generate(**kwargs):
+    """ Return the bytes written by OFXGenerator(**kwargs) """
+    f = BytesIO()
+    size = OFXGenerator(**kwargs).write(f)
+    data = f.getvalue()
+    assert size == len(data)
+    return data
+
+
+def convert(data):
+    """ Parse & convert a generated document; return the OFXResponse """
+    tree = OFXTree()
+    tree.parse(BytesIO(data))
+    return tree.convert()
+
+
+class OFXGeneratorTestCase(unittest.TestCase):
+    def test_versions(self):
+        for version, closing_tags in ((102, True), (102, False), (200, True)):
+            data = generate(accounts=2, transactions=30, version=version,
+                            closing_tags=closing_tags)
+            self.assertEqual(b'</TRNAMT>' in data, closing_tags)
+            response = convert(data)
+            self.assertEqual([len(stmt.transactions)
+                              for stmt in response.statements], [30, 30])
+            self.assertEqual(len(set([stmt.account.acctid
+                                      for stmt in response.statements])), 2)
+
+    def test_creditcard(self):
+        response = convert(generate(acctkind='creditcard', transactions=5))
+        self.assertEqual(response.statements[0].__class__.__name__,
+                         'CreditCardStatement')
+
+    def test_investment(self):
+        response = convert(generate(acctkind='investment', accounts=2,
+                                    transactions=40, securities=8,
+                                    positions=5, closing_tags=False))
+        self.assertEqual(len(response.securities), 8)
+        for stmt in response.statements:
+            self.assertEqual(len(stmt.transactions), 40)
+            self.assertEqual(len(stmt.positions), 5)
+
+    def test_trntypes(self):
+        response = convert(generate(transactions=200,
+                                    trntypes={'ATM': 3, 'CHECK': 1}))
+        counts = Counter([tx.trntype
+                          for tx in response.statements[0].transactions])
+        self.assertEqual(set(counts), set(['ATM', 'CHECK']))
+        self.assertGreater(counts['ATM'], counts['CHECK'])
+
+    def test_seed(self):
+        self.assertEqual(generate(seed=1), generate(seed=1))
+        self.assertNotEqual(generate(seed=1), generate(seed=2))
+
+    def test_seed_fitids(self):
+        # Documents with different seeds for the same accounts must not share
+        # FITIDs, or loading both into one database would collide.
+        def keys(seed):
+            response = convert(generate(acctkind='investment', transactions=20,
+                                        securities=2, seed=seed))
+            return set([(stmt.account.acctid, tx.fitid)
+                        for stmt in response.statements
+                        for tx in stmt.transactions])
+        self.assertEqual(len(keys(1)), 20)
+        self.assertFalse(keys(1) & keys(2))
+
+    def test_chunks(self):
+        generator = OFXGenerator(transactions=5000)
+        generator.chunksize = 4096
+        chunks = list(generator.chunks())
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual(''.join(chunks).encode('ascii'),
+                         generate(transactions=5000))
+
+    def test_invalid(self):
+        for kwargs in ({'acctkind': 'savings'},
+                       {'version': 200, 'closing_tags': False},
+                       {'positions': 1},
+                       {'acctkind': 'investment'},
+                       {'acctkind': 'investment', 'securities': 1,
+                        'positions': 2},
+                       {'acctkind': 'investment', 'securities': 1,
+                        'trntypes': {'CHECK': 1}}):
+            with self.assertRaises(ValueError):
+                OFXGenerator(**kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@
 import unittest
 import decimal
 import datetime
+import threading
 
 import ofxtools
 
@@ -158,12 +159,67 @@ class DateTimeTestCase(unittest.TestCase, Base):
         # Accept YYYYMMDDHHMMSS.XXX
         check = datetime.datetime(2011, 11, 17, 3, 30, 45, 150)
         self.assertEqual(check, t.convert('20111117033045.150'))
+        # Accept timezone; convert to GMT
+        check = datetime.datetime(2011, 11, 17, 8, 30, 45, 0)
+        self.assertEqual(check, t.convert('20111117033045[-5:EST]'))
+
+    def test_cache(self):
+        t = self.type_()
+        cache = self.type_.cache
+        cache.clear()
+        first = t.convert('20111117033045')
+        self.assertEqual(cache.info(), (0, 1, cache.maxsize, 1))
+        # Same string from another instance hits the cache
+        self.assertIs(self.type_(required=True).convert('20111117033045'),
+                      first)
+        self.assertEqual(cache.info(), (1, 1, cache.maxsize, 1))
+        # Invalid values aren't cached
+        for i in range(2):
+            with self.assertRaises(ValueError):
+                t.convert('20111317')
+        self.assertEqual(len(cache), 1)
+
+    def test_cache_eviction(self):
+        cache = ofxtools.utils.LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache['a'], 1)
+        cache['c'] = 3
+        # 'b' was least recently used
+        with self.assertRaises(KeyError):
+            cache['b']
+        self.assertEqual(cache.info(), (1, 1, 2, 2))
+
+    def test_cache_threads(self):
+        cache = ofxtools.utils.LRUCache(maxsize=8)
+
+        def work(offset):
+            for n in range(2000):
+                key = (n + offset) % 16
+                try:
+                    self.assertEqual(cache[key], key)
+                except KeyError:
+                    cache[key] = key
+
+        threads = [threading.Thread(target=work, args=(n, ))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        info = cache.info()
+        self.assertEqual(info.hits + info.misses, 8000)
+        self.assertEqual(info.currsize, 8)
 
     def test_illegal(self):
         t = self.type_()
         # Don't accept string
         with self.assertRaises(ValueError):
             t.convert('2015-10-29')
+        with self.assertRaises(ValueError):
+            t.convert('20151029 1200')
+        with self.assertRaises(ValueError):
+            t.convert('20151029120000,000')
         # Don't accept integer
         with self.assertRaises(ValueError):
             t.convert(123)